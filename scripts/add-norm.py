@@ -1,60 +1,54 @@
 #!/usr/bin/env python3
 
 """
-converts the textpart-per-paragraph to textpart-per-sentence.
+adds the normalised form and flags of each token to the sentence files.
 """
 
-from utils import print_interlinear
+import argparse
 
-from greek_normalisation.normalise import Normaliser, Norm
+from chapters import chapters_argument, corpus_chapters, selected
+from interlinear import analysis_filename, read_text, write_interlinear
+from normalisation import NORMALISATION, normalise
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+from utils import jobs_argument, map_chapters
 
-config = (
-    Norm.GRAVE
-    | Norm.ELISION
-    | Norm.MOVABLE
-    | Norm.EXTRA
-    | Norm.PROCLITIC
-    | Norm.ENCLITIC
-)
 
+CHAPTERS = corpus_chapters()
 
-def format_flags(flags):
-    s = ""
-    if flags & Norm.PROCLITIC:
-        s += "p"
-    if flags & Norm.ENCLITIC:
-        s += "n"
-    if flags & Norm.GRAVE:
-        s += "g"
-    if flags & Norm.EXTRA:
-        s += "x"
-    if flags & Norm.ELISION:
-        s += "l"
-    if flags & Norm.MOVABLE:
-        s += "m"
 
-    if s == "":
-        s = "."
+def normalise_sentence(sentence):
+    norms = [normalise(token) for token in sentence.text]
+    sentence.norm = [norm for norm, _ in norms]
+    sentence.flags = [flags for _, flags in norms]
 
-    return s
 
-
-normalise = Normaliser(config).normalise
-
-for chapter_num in range(1, 20):
+def process_chapter(chapter_num):
     input_filename = f"text/lgpsi.sent.{chapter_num:03d}.txt"
-    output_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.norm.txt"
-
-    with open(input_filename) as f, open(output_filename, "w") as g:
-        for line in f:
-            line = line.strip()
-            ref, *text = line.split()
-            text_list = [f"{ref}.text", *text]
-            norm = [f"{ref}.norm"]
-            flags = [f"{ref}.flags"]
-            for token in text:
-                norm_token, norm_flags = normalise(token.strip(",.;·«»()!"))
-                norm.append(norm_token)
-                flags.append(format_flags(norm_flags))
-
-            print_interlinear([text_list, flags, norm], g)
+    output_filename = analysis_filename(chapter_num, "norm")
+
+    with PROFILE.chapter(
+        "add-norm", chapter_num, [input_filename], [output_filename]
+    ) as record:
+        sentences = read_text(input_filename)
+        with PROFILE.section("normalise"):
+            for sentence in sentences:
+                normalise_sentence(sentence)
+
+        write_interlinear(sentences, ["text", "flags", "norm"], output_filename)
+        record["tokens"] += count_tokens(sentences)
+
+    return NORMALISATION.take_new()  # for the parent to save if this is a worker
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    chapters_argument(parser)
+    jobs_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    for new_norms in map_chapters(
+        "add-norm", "process_chapter", selected(CHAPTERS, args.chapters), args.jobs
+    ):
+        NORMALISATION.update(new_norms)
@@ -4,42 +4,123 @@
 adds exposure counts for both lemmas and normalized forms to the interlinear.
 """
 
-from collections import Counter
+import argparse
 
-from utils import print_interlinear
+from chapters import chapters_argument, corpus_chapters
+from checkpoints import Checkpoints
+from exposure_engine import Exposures
+from interlinear import analysis_filename, read_interlinear, write_interlinear
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
 
-seen_norm = Counter()
-seen_lemma = Counter()
 
-for chapter_num in range(1, 20):
-    input_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.lemma.txt"
-    output_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.exposures.txt"
+CHAPTERS = corpus_chapters()
 
-    with open(input_filename) as f, open(output_filename, "w") as g:
-        for line in f:
+# the code the exposures (and so their snapshots) depend on
+CODE_FILENAMES = [
+    "scripts/add_exposures.py",
+    "scripts/exposure_engine.py",
+    "scripts/interlinear.py",
+    "scripts/utils.py",
+]
 
-            if ".text" in line:
-                text_list = line.strip().split()
 
-            if ".norm" in line:
-                ref = line.split(".norm")[0]
-                norm_list = line.strip().split()
-                normexp_list = [f"{ref}.normexp"]
+def add_exposures(sentences, exposures):
+    """
+    sets the exposure rows of each sentence, counting the norms and lemmas of
+    all of them at once into `exposures`.
+    """
+    normexp, lemmaexp = exposures.add(
+        [norm for sentence in sentences for norm in sentence.norm],
+        [lemma for sentence in sentences for lemma in sentence.lemma],
+    )
+    normexp = normexp.tolist()
+    lemmaexp = lemmaexp.tolist()
 
-                for norm in norm_list[1:]:
-                    seen_norm[norm] += 1
-                    normexp_list.append(str(seen_norm[norm]))
+    norm_start = lemma_start = 0
+    for sentence in sentences:
+        norm_end = norm_start + len(sentence.norm)
+        lemma_end = lemma_start + len(sentence.lemma)
+        sentence.normexp = normexp[norm_start:norm_end]
+        sentence.lemmaexp = lemmaexp[lemma_start:lemma_end]
+        norm_start = norm_end
+        lemma_start = lemma_end
 
-            if ".flags" in line:
-                flags_list = line.strip().split()
 
-            if ".lemma" in line:
-                lemma_list = line.strip().split()
-                ref = line.split(".lemma")[0]
-                lemmaexp_list = [f"{ref}.lemmaexp"]
+def process_chapter(chapter_num, exposures, write=True):
+    """
+    updates the exposure counts with the given chapter and (unless `write` is
+    false, as when just catching the counts up) writes its exposures.
+    """
+    input_filename = analysis_filename(chapter_num, "lemma")
+    output_filename = analysis_filename(chapter_num, "exposures")
 
-                for lemma in lemma_list[1:]:
-                    seen_lemma[lemma] += 1
-                    lemmaexp_list.append(str(seen_lemma[lemma]))
+    with PROFILE.chapter(
+        "add_exposures",
+        chapter_num,
+        [input_filename],
+        [output_filename] if write else [],
+    ) as record:
+        sentences = read_interlinear(input_filename)
+        add_exposures(sentences, exposures)
 
-                print_interlinear([text_list, norm_list, flags_list, lemma_list, normexp_list, lemmaexp_list], g)
+        if write:
+            write_interlinear(
+                sentences,
+                ["text", "norm", "flags", "lemma", "normexp", "lemmaexp"],
+                output_filename,
+            )
+        record["tokens"] += count_tokens(sentences)
+
+
+def checkpoints():
+    """
+    the snapshots of the exposure counts after each chapter.
+    """
+    return Checkpoints(
+        "exposures", CODE_FILENAMES,
+        lambda chapter_num: analysis_filename(chapter_num, "lemma"),
+        lambda chapter_num: analysis_filename(chapter_num, "exposures"),
+    )
+
+
+def new_state():
+    return (Exposures(),)
+
+
+def exposures_as_of(chapter_num):
+    """
+    returns the `Exposures` up to and including the given chapter: its
+    snapshot if that is good, otherwise replayed.
+    """
+    state = checkpoints().state_as_of(chapter_num, CHAPTERS)
+    if state is None:
+        state = new_state()
+        for earlier_num in CHAPTERS:
+            if earlier_num > chapter_num:
+                break
+            process_chapter(earlier_num, *state, write=False)
+    return state[0]
+
+
+def process_chapters(only=None, rewrite=(), force=False):
+    """
+    writes the exposures of the chapters (of those in `only`) that are out
+    of date or in `rewrite`, resuming from the snapshot of the counts
+    before the first of them, and returns the chapters written.
+    """
+    return checkpoints().run(CHAPTERS, process_chapter, new_state, only, rewrite, force)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rewrite every chapter, ignoring the snapshots",
+    )
+    chapters_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    process_chapters(only=args.chapters, force=args.force)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+"""
+times each script over a synthetic corpus built from the chapters in `orig`.
+
+The corpus is written to a scratch copy of the repo, each chapter repeated
+`--scale` times with `--vocabulary` distinct forms, and lemmatised against a
+local Morpheus stand-in. Results are appended as JSON lines to `--output`.
+"""
+
+import argparse
+from collections import Counter
+import datetime
+import glob
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from chapters import MANIFEST_FILENAME, corpus_chapters
+from morpheus import open_cache
+from morpheus_server import serve
+
+
+ORIG_CHAPTERS = corpus_chapters()
+
+OUTPUT_FILENAME = "cache/benchmarks.jsonl"
+
+PUNCTUATION = ".,;·!:()\"'«»—"
+
+ELISION = "’"
+
+GREEK_LETTERS = "αβγδεζηθικλμνξοπρστυφχψω"
+
+# each script with the arguments it is run with and the outputs it writes
+SCRIPTS = [
+    ("orig-to-para", [], ["text/lgpsi.para.*.txt"]),
+    ("para-to-sent", [], ["text/lgpsi.sent.*.txt"]),
+    ("add-norm", [], ["analysis/lgpsi.sent.*.norm.*"]),
+    ("lemmatise", [], ["analysis/lgpsi.sent.*.lemma.*"]),
+    ("add_exposures", [], ["analysis/lgpsi.sent.*.exposures.*"]),
+    ("generate-chapter-data", [], ["analysis/lgpsi.*.json"]),
+    ("concordance", ["build"], ["cache/concordance.idx"]),
+    ("render", [], ["docs/*.html"]),
+]
+
+
+def split_token(token):
+    """
+    splits a token into leading punctuation, word and trailing punctuation.
+    """
+    word = token.strip(PUNCTUATION)
+    if not word:
+        return token, "", ""
+    start = token.index(word)
+    return token[:start], word, token[start + len(word):]
+
+
+def made_up_form(i, words):
+    """
+    the i-th made-up form: a real word with a suffix of letters (before any
+    elision mark).
+    """
+    word = words[i % len(words)]
+    stem = word.rstrip(ELISION)
+    n = i // len(words) + 1
+    suffix = ""
+    while n:
+        n, digit = divmod(n - 1, len(GREEK_LETTERS))
+        suffix = GREEK_LETTERS[digit] + suffix
+    return stem + suffix + word[len(stem):]
+
+
+class Vocabulary:
+    """
+    remaps words so a corpus has (roughly) the given number of distinct forms.
+    """
+
+    def __init__(self, word_counts, size, rng):
+        self.rng = rng
+        words = [word for word, _ in word_counts.most_common()]
+        self.mapping = {}
+        self.new_forms = []
+        self.new_rate = 0
+        if size and size < len(words):
+            for word in words[size:]:
+                self.mapping[word] = words[rng.randrange(size)]
+        elif size and size > len(words):
+            # only Greek words are made more of (not numerals, `C.` and so on)
+            greek = [
+                word
+                for word in words
+                if word.rstrip(ELISION).isalpha() and not word.isascii()
+            ]
+            self.new_forms = [
+                made_up_form(i, greek) for i in range(size - len(words))
+            ]
+            self.new_rate = len(self.new_forms) / size
+
+    def __call__(self, word):
+        if self.new_rate and self.rng.random() < self.new_rate:
+            return self.rng.choice(self.new_forms)
+        return self.mapping.get(word, word)
+
+
+def read_chapter(chapter_num):
+    """
+    returns the heading and body lines of an original chapter.
+    """
+    with open(f"orig/{chapter_num:03d}.md") as f:
+        lines = [line.rstrip("\n") for line in f]
+    heading = next(i for i, line in enumerate(lines) if line.startswith("# "))
+    return lines[:heading + 1], lines[heading + 1:]
+
+
+def is_text(line):
+    return line.strip() and not line.startswith("#")
+
+
+def write_corpus(directory, chapters, scale, vocabulary_size, seed):
+    """
+    writes the synthetic `orig` files, returning their token and form counts.
+    """
+    rng = random.Random(seed)
+    originals = {
+        chapter_num: read_chapter(chapter_num) for chapter_num in ORIG_CHAPTERS
+    }
+
+    word_counts = Counter()
+    for _, body in originals.values():
+        for line in filter(is_text, body):
+            for token in line.split():
+                word_counts[split_token(token)[1]] += 1
+    del word_counts[""]
+    vocabulary = Vocabulary(word_counts, vocabulary_size, rng)
+
+    tokens = 0
+    forms = set()
+    for chapter_num in range(1, chapters + 1):
+        heading, body = originals[ORIG_CHAPTERS[(chapter_num - 1) % len(ORIG_CHAPTERS)]]
+        with open(os.path.join(directory, f"orig/{chapter_num:03d}.md"), "w") as g:
+            for line in heading:
+                print(line, file=g)
+            for _ in range(scale):
+                for line in body:
+                    if is_text(line):
+                        new_tokens = []
+                        for token in line.split():
+                            before, word, after = split_token(token)
+                            if word:
+                                word = vocabulary(word)
+                                forms.add(word)
+                            new_tokens.append(before + word + after)
+                        tokens += len(new_tokens)
+                        line = " ".join(new_tokens)
+                    print(line, file=g)
+
+    return tokens, len(forms)
+
+
+def make_workdir(directory):
+    """
+    sets up a scratch copy of the repo's scripts, manual data and config
+    (without the corpus manifest, so every synthetic chapter is lemmatised).
+    """
+    for subdirectory in ["orig", "text", "analysis", "docs", "cache"]:
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+    shutil.copytree(
+        "manual-data", os.path.join(directory, "manual-data"), dirs_exist_ok=True
+    )
+    shutil.copytree(
+        "config", os.path.join(directory, "config"), dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns(os.path.basename(MANIFEST_FILENAME)),
+    )
+    shutil.copytree(
+        "scripts", os.path.join(directory, "scripts"), dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+
+
+def output_size(directory, patterns):
+    return sum(
+        os.path.getsize(filename)
+        for pattern in patterns
+        for filename in glob.glob(os.path.join(directory, pattern))
+    )
+
+
+def run_script(directory, script, args, env):
+    """
+    runs a script in the scratch copy, returning its wall time and peak RSS.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, f"scripts/{script}.py", *args],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    # as subprocess would set it (os.waitstatus_to_exitcode is Python 3.9+)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    if process.returncode:
+        raise SystemExit(f"{script} failed with exit code {process.returncode}")
+    return elapsed, rusage.ru_maxrss  # kilobytes on Linux
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(directory, chapters, scale, vocabulary, seed, warm):
+    make_workdir(directory)
+    tokens, forms = write_corpus(directory, chapters, scale, vocabulary, seed)
+    print(f"synthetic corpus: {chapters} chapters, {tokens} tokens, {forms} forms")
+
+    cache = open_cache("cache/morpheus.sqlite")
+    analyses = dict(iter(cache))
+    cache.close()
+    if warm:
+        shutil.copy(
+            "cache/morpheus.sqlite", os.path.join(directory, "cache/morpheus.sqlite")
+        )
+
+    server = serve(analyses, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(
+        os.environ, MORPHEUS_ENDPOINT=f"http://localhost:{server.server_address[1]}/"
+    )
+
+    results = []
+    try:
+        for script, args, outputs in SCRIPTS:
+            elapsed, peak_rss = run_script(directory, script, args, env)
+            results.append({
+                "script": script,
+                "seconds": round(elapsed, 3),
+                "tokens_per_second": round(tokens / elapsed),
+                "peak_rss_kb": peak_rss,
+                "output_bytes": output_size(directory, outputs),
+            })
+            print(
+                f"{script:22} {elapsed:8.2f}s {tokens / elapsed:10.0f} tokens/s"
+                f" {peak_rss / 1024:8.1f}MB peak"
+                f" {results[-1]['output_bytes']:12} bytes out"
+            )
+    finally:
+        server.shutdown()
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "corpus": {
+            "chapters": chapters,
+            "scale": scale,
+            "vocabulary": vocabulary,
+            "seed": seed,
+            "warm": warm,
+            "tokens": tokens,
+            "forms": forms,
+        },
+        "scripts": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--chapters", type=int, default=len(ORIG_CHAPTERS), help="number of chapters"
+    )
+    parser.add_argument(
+        "--scale", type=int, default=1, help="times each chapter's body is repeated"
+    )
+    parser.add_argument(
+        "--vocabulary",
+        type=int,
+        default=0,
+        help="number of distinct forms (default as is)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--warm", action="store_true", help="start from the repo's Morpheus cache"
+    )
+    parser.add_argument("--workdir", help="scratch directory to use (and keep)")
+    parser.add_argument(
+        "--output", default=OUTPUT_FILENAME, help="file to append the results to"
+    )
+    args = parser.parse_args()
+
+    directory = args.workdir or tempfile.mkdtemp(prefix="lgpsi-benchmark-")
+    try:
+        result = benchmark(
+            directory, args.chapters, args.scale, args.vocabulary, args.seed, args.warm
+        )
+    finally:
+        if not args.workdir:
+            shutil.rmtree(directory)
+
+    with open(args.output, "a") as g:
+        print(json.dumps(result, ensure_ascii=False), file=g)
@@ -0,0 +1,157 @@
+"""
+the per-chapter lemma data in `analysis/lgpsi.NNN.json`.
+
+Each chapter's file is a delta: the chapter's summary counts and, for just
+the lemmas in the chapter, how often each of their forms occurs in it. What
+had been seen before a chapter is rebuilt on demand from the deltas of the
+chapters before it (`Cumulative`), or taken from the snapshot
+`generate-chapter-data.py` keeps of it after each chapter, and `FullView`
+presents a chapter's delta against that in the shape of the original
+(whole-vocabulary) chapter data.
+"""
+
+from collections import Counter, defaultdict
+import json
+
+from checkpoints import Checkpoints
+from collation import sort_key
+from interlinear import analysis_filename
+
+
+# the code the chapter data (and so its snapshots) depends on
+CODE_FILENAMES = [
+    "scripts/generate-chapter-data.py",
+    "scripts/chapter_data.py",
+    "scripts/exposure_engine.py",
+    "scripts/collation.py",
+    "scripts/interlinear.py",
+]
+
+
+def delta_filename(chapter_num):
+    return f"analysis/lgpsi.{chapter_num:03d}.json"
+
+
+def read_delta(chapter_num):
+    with open(delta_filename(chapter_num)) as f:
+        return json.load(f)
+
+
+def write_delta(chapter_num, delta):
+    with open(delta_filename(chapter_num), "w") as g:
+        json.dump(delta, g, ensure_ascii=False, separators=(",", ":"))
+
+
+def checkpoints():
+    """
+    the snapshots of the cumulative state after each chapter's delta.
+    """
+    return Checkpoints(
+        "chapter-data", CODE_FILENAMES,
+        lambda chapter_num: analysis_filename(chapter_num, "lemma"), delta_filename,
+    )
+
+
+class Cumulative:
+    """
+    what has been seen in the chapters added so far.
+    """
+
+    def __init__(self):
+        self.lemma_last_seen = {}
+        self.lemma_form_last_seen = {}
+        self.lemma_count = Counter()
+        self.lemma_form_count = defaultdict(Counter)
+
+    def add(self, chapter_num, delta):
+        for lemma, forms in delta["lemmas"].items():
+            self.lemma_last_seen[lemma] = chapter_num
+            for form, count in forms.items():
+                self.lemma_form_last_seen[(lemma, form)] = chapter_num
+                self.lemma_form_count[lemma][form] += count
+                self.lemma_count[lemma] += count
+
+    @classmethod
+    def as_of(cls, chapter_num, chapters):
+        """
+        what had been seen up to and including the given chapter: its
+        snapshot if that is good, otherwise rebuilt from the deltas.
+        """
+        state = checkpoints().state_as_of(chapter_num, chapters)
+        if state is not None:
+            return state[0]
+        cumulative = cls()
+        for earlier_num in chapters:
+            if earlier_num > chapter_num:
+                break
+            cumulative.add(earlier_num, read_delta(earlier_num))
+        return cumulative
+
+    @classmethod
+    def before(cls, chapter_num, chapters):
+        """
+        what had been seen before the given chapter.
+        """
+        earlier = [earlier_num for earlier_num in chapters if earlier_num < chapter_num]
+        return cls.as_of(earlier[-1], chapters) if earlier else cls()
+
+
+class FullView:
+    """
+    a chapter's delta against `cumulative` (which mustn't have had the chapter
+    added yet) in the shape of the original chapter data: the summary counts
+    by key plus, from `lemmas()`, data on every lemma seen so far.
+    """
+
+    def __init__(self, chapter_num, delta, cumulative):
+        self.chapter_num = chapter_num
+        self.delta = delta
+        self.cumulative = cumulative
+
+    def __getitem__(self, key):
+        return self.delta[key]
+
+    def unseen_count(self):
+        """
+        the number of lemmas seen before that aren't in the chapter.
+        """
+        return len(self.cumulative.lemma_count.keys() - self.delta["lemmas"].keys())
+
+    def lemmas(self, chapter_only=False):
+        """
+        yields (lemma, lemma_data) in collation order, built as it goes, for
+        every lemma seen so far or, if `chapter_only`, just the chapter's.
+        """
+        cumulative = self.cumulative
+        chapter_lemmas = self.delta["lemmas"]
+
+        if chapter_only:
+            lemmas = chapter_lemmas.keys()  # already in collation order
+        else:
+            lemmas = sorted(
+                chapter_lemmas.keys() | cumulative.lemma_count.keys(), key=sort_key
+            )
+
+        for lemma in lemmas:
+            chapter_forms = chapter_lemmas.get(lemma, {})
+            lemma_data = {}
+            lemma_data["cumulative_last_seen"] = cumulative.lemma_last_seen.get(
+                lemma, 0
+            )
+            lemma_data["cumulative_lemma_count"] = cumulative.lemma_count[lemma]
+            lemma_data["chapter_lemma_count"] = sum(chapter_forms.values())
+            lemma_data["forms"] = {}
+
+            cumulative_forms = cumulative.lemma_form_count.get(lemma, {})
+            for form in sorted(
+                cumulative_forms.keys() | chapter_forms.keys(), key=sort_key
+            ):
+                form_data = {}
+                form_data["cumulative_lemma_form_last_seen"] = (
+                    cumulative.lemma_form_last_seen.get((lemma, form), 0)
+                )
+                form_data["cumulative_lemma_form_count"] = cumulative_forms.get(form, 0)
+                form_data["chapter_lemma_form_count"] = chapter_forms.get(form, 0)
+                lemma_data["forms"][form] = form_data
+
+            yield lemma, lemma_data
@@ -0,0 +1,138 @@
+"""
+the chapters making up the corpus.
+
+These are the chapters with an `orig/NNN.md` file unless `config/corpus.yaml`
+lists them, e.g.
+
+    chapters: 1-19
+    lemmatised: 1-5
+
+where `lemmatised` gives the chapters `lemmatise.py` lemmatises (default all).
+"""
+
+from functools import lru_cache
+import os
+import re
+
+import yaml
+
+
+MANIFEST_FILENAME = "config/corpus.yaml"
+
+ORIG_DIRECTORY = "orig"
+ORIG_FILENAME = re.compile(r"(\d{3,})\.md$")
+
+
+def parse_chapters(spec):
+    """
+    parses a list of chapters and ranges of them, e.g. `1-5,7`, into the
+    sorted chapter numbers.
+    """
+    if isinstance(spec, int):
+        return [spec]
+    if isinstance(spec, list):
+        return sorted(
+            {chapter_num for item in spec for chapter_num in parse_chapters(item)}
+        )
+    chapters = set()
+    for part in str(spec).replace(" ", "").split(","):
+        start, _, end = part.partition("-")
+        try:
+            chapters.update(range(int(start), int(end or start) + 1))
+        except ValueError:
+            raise ValueError(f"bad chapter range {part!r} in {spec!r}") from None
+    return sorted(chapters)
+
+
+def format_chapters(chapters):
+    """
+    formats a list of chapter numbers compactly, e.g. `1, 7-19`.
+    """
+    ranges = []
+    for chapter_num in sorted(chapters):
+        if ranges and ranges[-1][1] == chapter_num - 1:
+            ranges[-1][1] = chapter_num
+        else:
+            ranges.append([chapter_num, chapter_num])
+    return ", ".join(
+        f"{start}" if start == end else f"{start}-{end}" for start, end in ranges
+    )
+
+
+def discover(directory=ORIG_DIRECTORY):
+    """
+    returns the numbers of the chapters with a file in `orig`, in order.
+    """
+    chapters = []
+    for filename in os.listdir(directory):
+        match = ORIG_FILENAME.match(filename)
+        if match:
+            chapters.append(int(match.group(1)))
+    return sorted(chapters)
+
+
+@lru_cache(maxsize=None)
+def manifest():
+    if os.path.exists(MANIFEST_FILENAME):
+        with open(MANIFEST_FILENAME) as f:
+            return yaml.safe_load(f) or {}
+    return {}
+
+
+def corpus_chapters():
+    """
+    the chapters in the corpus, in order.
+    """
+    if "chapters" in manifest():
+        return parse_chapters(manifest()["chapters"])
+    return discover()
+
+
+def lemmatised_chapters():
+    """
+    the chapters lemmatised with Morpheus, in order.
+    """
+    chapters = corpus_chapters()
+    if "lemmatised" in manifest():
+        lemmatised = set(parse_chapters(manifest()["lemmatised"]))
+        chapters = [
+            chapter_num for chapter_num in chapters if chapter_num in lemmatised
+        ]
+    return chapters
+
+
+def chapters_argument(parser):
+    parser.add_argument(
+        "--chapters", metavar="LIST", type=parse_chapters,
+        help="only process these chapters, e.g. 7-12 (default all)",
+    )
+
+
+def selected(chapters, only):
+    """
+    the given chapters that are in `only` (all of them if `only` is None).
+    """
+    if only is None:
+        return list(chapters)
+    only = set(only)
+    return [chapter_num for chapter_num in chapters if chapter_num in only]
+
+
+def catching_up(chapters, only):
+    """
+    yields `(chapter_num, write)` for each of the given chapters up to the
+    last one in `only` (or all of them if `only` is None), `write` being
+    whether it is in `only` or is just to be caught up on.
+    """
+    if only is None:
+        for chapter_num in chapters:
+            yield chapter_num, True
+        return
+    only = set(only)
+    if not only:
+        return
+    last = max(only)
+    for chapter_num in chapters:
+        if chapter_num > last:
+            break
+        yield chapter_num, chapter_num in only
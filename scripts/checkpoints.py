@@ -0,0 +1,206 @@
+"""
+snapshots of a cumulative stage's state after each chapter, so a rerun can
+resume just before the first chapter that needs redoing.
+
+Snapshots are pickled to `cache/checkpoints/<stage>/NNN.pickle`, indexed in
+`cache/checkpoints/<stage>.json` by a key over the stage's code, the chapter's
+input and the state before it.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+from chapters import selected
+from utils import file_hash, fingerprint
+
+
+DIRECTORY = "cache/checkpoints"
+
+
+def canonical(value):
+    """
+    the value with any dicts as sorted lists of items (and objects as their
+    attributes) so equal states pickle the same.
+    """
+    if isinstance(value, dict):
+        return sorted((key, canonical(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if hasattr(value, "__dict__"):
+        return canonical(vars(value))
+    return value
+
+
+def digest(state):
+    return hashlib.sha256(pickle.dumps(canonical(state), protocol=4)).hexdigest()
+
+
+class Checkpoints:
+    """
+    the snapshots of the named stage, whose output for a chapter is written
+    from `input_filename(chapter_num)` to `output_filename(chapter_num)` by
+    the code in `code_filenames`.
+    """
+
+    def __init__(self, name, code_filenames, input_filename, output_filename):
+        self.directory = os.path.join(DIRECTORY, name)
+        self.index_filename = self.directory + ".json"
+        self.code_hash = fingerprint(
+            *(file_hash(filename) for filename in code_filenames)
+        )
+        self.input_filename = input_filename
+        self.output_filename = output_filename
+        self.index = {}
+        if os.path.exists(self.index_filename):
+            with open(self.index_filename) as f:
+                self.index = json.load(f)
+
+    def snapshot_filename(self, chapter_num):
+        return os.path.join(self.directory, f"{chapter_num:03d}.pickle")
+
+    def key(self, chapter_num, previous_digest):
+        return fingerprint(
+            self.code_hash, file_hash(self.input_filename(chapter_num)), previous_digest
+        )
+
+    def is_good(self, chapter_num, previous_digest):
+        entry = self.index.get(str(chapter_num))
+        return (
+            entry is not None
+            and entry["key"] == self.key(chapter_num, previous_digest)
+            and entry["output"] == file_hash(self.output_filename(chapter_num))
+            and os.path.exists(self.snapshot_filename(chapter_num))
+        )
+
+    def good(self, chapters):
+        """
+        returns the leading chapters (of those given, in order) whose
+        snapshots are good.
+        """
+        good = []
+        previous_digest = ""
+        for chapter_num in chapters:
+            if not self.is_good(chapter_num, previous_digest):
+                break
+            good.append(chapter_num)
+            previous_digest = self.index[str(chapter_num)]["digest"]
+        return good
+
+    def digest(self, chapter_num):
+        return self.index[str(chapter_num)]["digest"]
+
+    def load(self, chapter_num):
+        with open(self.snapshot_filename(chapter_num), "rb") as f:
+            return pickle.load(f)
+
+    def save(self, chapter_num, state, previous_digest):
+        """
+        snapshots the state after a chapter (whose output has been written),
+        returning its digest.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.snapshot_filename(chapter_num)
+        with open(filename + ".tmp", "wb") as g:
+            pickle.dump(state, g, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + ".tmp", filename)
+        state_digest = digest(state)
+        self.index[str(chapter_num)] = {
+            "key": self.key(chapter_num, previous_digest),
+            "digest": state_digest,
+            "output": file_hash(self.output_filename(chapter_num)),
+        }
+        return state_digest
+
+    def write_index(self):
+        os.makedirs(DIRECTORY, exist_ok=True)
+        with open(self.index_filename + ".tmp", "w") as g:
+            json.dump(self.index, g)
+        os.replace(self.index_filename + ".tmp", self.index_filename)
+
+    def good_after(self, chapter_num, previous_digest, chapters, last):
+        """
+        whether the snapshots of the given chapters after `chapter_num` (up to
+        `last`) are all good, chaining on from the given digest.
+        """
+        for later_num in chapters:
+            if later_num <= chapter_num:
+                continue
+            if later_num > last:
+                break
+            if not self.is_good(later_num, previous_digest):
+                return False
+            previous_digest = self.digest(later_num)
+        return True
+
+    def state_as_of(self, chapter_num, chapters):
+        """
+        returns the state after the given chapter (of those given) if its
+        snapshot is good, otherwise None.
+        """
+        earlier = [
+            earlier_num for earlier_num in chapters if earlier_num <= chapter_num
+        ]
+        if earlier and self.good(earlier) == earlier:
+            return self.load(chapter_num)
+        return None
+
+    def run(self, chapters, process, new_state, only=None, rewrite=(), force=False):
+        """
+        calls `process(chapter_num, *state, write=...)` for the chapters
+        (of those in `only`, if given) whose snapshots aren't good or which
+        are in `rewrite` (or all of them, if `force`), starting from the
+        snapshot before the first of them and catching up on any chapters
+        in between not to be written. Stops early once the state after a
+        chapter is as it was last time and the snapshots of the chapters
+        left to write are good from there. Returns the chapters written.
+        """
+        good = [] if force else self.good(chapters)
+        good_chapters = set(good)
+        rewrite = set(rewrite)
+        to_write = [
+            chapter_num for chapter_num in selected(chapters, only)
+            if chapter_num not in good_chapters or chapter_num in rewrite
+        ]
+        if not to_write:
+            return []
+
+        earlier = [chapter_num for chapter_num in good if chapter_num < to_write[0]]
+        if earlier:
+            state = self.load(earlier[-1])
+            previous_digest = self.digest(earlier[-1])
+        else:
+            state = new_state()
+            previous_digest = ""
+
+        last_rewrite = max(rewrite, default=0)
+        written = []
+        to_write = set(to_write)
+        for chapter_num in chapters:
+            if earlier and chapter_num <= earlier[-1]:
+                continue
+            if chapter_num > max(to_write):
+                break
+            write = chapter_num in to_write
+            process(chapter_num, *state, write=write)
+            if not write:
+                previous_digest = None  # so no later snapshot is saved
+                continue
+            written.append(chapter_num)
+            if previous_digest is None:
+                continue
+            old_digest = self.index.get(str(chapter_num), {}).get("digest")
+            previous_digest = self.save(chapter_num, state, previous_digest)
+            if (
+                not force
+                and chapter_num >= last_rewrite
+                and previous_digest == old_digest
+                and self.good_after(
+                    chapter_num, previous_digest, chapters, max(to_write)
+                )
+            ):
+                break  # the rest are as they were
+
+        self.write_index()
+        return written
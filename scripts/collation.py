@@ -0,0 +1,101 @@
+"""
+Unicode collation shared by the scripts, with sort keys remembered.
+
+Sort keys already worked out are kept in `cache/sort_keys.json`, so a
+script only sorts words it hasn't seen before with the collator. The collator
+parses the full DUCET table when built, so it is only built when a key is
+missing, and it is then pickled to `cache/collator.pickle` to load faster
+next time.
+"""
+
+import atexit
+import json
+import os
+import pickle
+
+from pyuca import Collator
+
+
+SORT_KEYS_FILENAME = "cache/sort_keys.json"
+COLLATOR_FILENAME = "cache/collator.pickle"
+
+
+def load_collator():
+    """
+    loads the pickled collator (if it is for the installed pyuca's table) or
+    builds it and pickles it.
+    """
+    if os.path.exists(COLLATOR_FILENAME):
+        with open(COLLATOR_FILENAME, "rb") as f:
+            name, collator = pickle.load(f)
+        if name == Collator.__name__:
+            return collator
+    collator = Collator()
+    os.makedirs(os.path.dirname(COLLATOR_FILENAME), exist_ok=True)
+    with open(COLLATOR_FILENAME + ".tmp", "wb") as g:
+        pickle.dump((Collator.__name__, collator), g, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(COLLATOR_FILENAME + ".tmp", COLLATOR_FILENAME)
+    return collator
+
+
+class Collation:
+    """
+    collation keys for strings, from the side table where known and from the
+    (lazily loaded) collator otherwise, any new ones being saved on exit.
+    """
+
+    def __init__(self, filename=SORT_KEYS_FILENAME):
+        self.filename = filename
+        self.collator = None
+        self.keys = None  # loaded when first needed
+        self.new_keys = 0
+
+    def load(self):
+        self.keys = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                table = json.load(f)
+            if table["collator"] == Collator.__name__:
+                self.keys = {s: tuple(key) for s, key in table["keys"].items()}
+
+    def load_collator(self):
+        if self.collator is None:
+            self.collator = load_collator()
+            atexit.register(self.save)
+
+    def collation_key(self, s):
+        if self.keys is None:
+            self.load()
+        key = self.keys.get(s)
+        if key is None:
+            self.load_collator()
+            key = self.keys[s] = tuple(self.collator.sort_key(s))
+            self.new_keys += 1
+        return key
+
+    def save(self):
+        if not self.new_keys:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename + ".tmp", "w") as g:
+            json.dump(
+                {
+                    "collator": Collator.__name__,
+                    "keys": dict(sorted(self.keys.items())),
+                },
+                g,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        os.replace(self.filename + ".tmp", self.filename)
+        self.new_keys = 0
+
+
+COLLATION = Collation()
+
+collation_key = COLLATION.collation_key
+
+
+def sort_key(s):
+    # ties broken on the string itself so the order is the same from run to run
+    return collation_key(s), s
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""
+a binary columnar format for the interlinear files in `analysis`.
+
+Each row is an array of 32-bit ids into one string table per chapter, read
+through `mmap` so nothing is copied until sentences are asked for. The layout
+(little-endian) is `MAGIC`, the stored rows (indexes into `ROWS`, 1-based,
+padded with 0s), the sentence, token and string counts and the string data
+size, then:
+
+    string offsets   (string count + 1) into the string data
+    sentence refs    (sentence count) string ids
+    sentence starts  (sentence count + 1) token offsets
+    each row         (token count) string ids, flag bitmasks or counts
+
+and then the UTF-8 string data. Run as a script, converts to and from `.col`.
+"""
+
+import argparse
+from array import array
+import mmap
+import struct
+import sys
+
+from interlinear import Sentence
+
+
+MAGIC = b"LGPSICOL"
+
+ROWS = ["text", "norm", "flags", "lemma", "normexp", "lemmaexp"]
+STRING_ROWS = {"text", "norm", "lemma"}
+
+HEADER = struct.Struct("<8s6B2x4I")
+
+# the flags from `add-norm.py`, in the order they're written
+FLAG_LETTERS = "pngxlm"
+
+
+def encode_flags(flags):
+    bits = 0
+    for letter in flags:
+        if letter != ".":
+            bits |= 1 << FLAG_LETTERS.index(letter)
+    return bits
+
+
+# every combination decoded up front
+DECODED_FLAGS = [
+    "".join(letter for i, letter in enumerate(FLAG_LETTERS) if bits & (1 << i)) or "."
+    for bits in range(1 << len(FLAG_LETTERS))
+]
+
+
+def write_columnar(sentences, names, filename):
+    """
+    writes the given rows of each sentence in the columnar format.
+    """
+    sentences = list(sentences)
+
+    string_ids = {}
+
+    def intern(s):
+        string_id = string_ids.get(s)
+        if string_id is None:
+            string_id = string_ids[s] = len(string_ids)
+        return string_id
+
+    refs = [intern(sentence.ref) for sentence in sentences]
+    starts = [0]
+    columns = {name: [] for name in names}
+    for sentence in sentences:
+        for name in names:
+            tokens = getattr(sentence, name)
+            if name in STRING_ROWS:
+                columns[name].extend(intern(token) for token in tokens)
+            elif name == "flags":
+                columns[name].extend(encode_flags(token) for token in tokens)
+            else:
+                columns[name].extend(tokens)
+        starts.append(len(columns[names[0]]))
+
+    data = bytearray()
+    offsets = [0]
+    for s in string_ids:  # in id order
+        data += s.encode("utf-8")
+        offsets.append(len(data))
+
+    rows = [ROWS.index(name) + 1 for name in names] + [0] * (len(ROWS) - len(names))
+    with open(filename, "wb") as g:
+        g.write(
+            HEADER.pack(
+                MAGIC, *rows, len(sentences), starts[-1], len(string_ids), len(data)
+            )
+        )
+        for values in [offsets, refs, starts, *(columns[name] for name in names)]:
+            g.write(memoryview(struct.pack(f"<{len(values)}I", *values)))
+        g.write(data)
+
+
+class ColumnarFile:
+    """
+    a columnar file mapped into memory, for use as a context manager.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, *rows, sentence_count, token_count, string_count, data_size = (
+            HEADER.unpack_from(self.buffer)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a columnar interlinear file")
+        self.names = [ROWS[row - 1] for row in rows if row]
+        self.sentence_count = sentence_count
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+
+        def column(length):
+            nonlocal offset
+            start, offset = offset, offset + length * 4
+            if sys.byteorder == "little":
+                return view[start:offset].cast("I")
+            # a big-endian host reads a byteswapped copy
+            values = array("I", view[start:offset])
+            values.byteswap()
+            return memoryview(values)
+
+        self.string_offsets = column(string_count + 1)
+        self.refs = column(sentence_count)
+        self.starts = column(sentence_count + 1)
+        self.columns = {name: column(token_count) for name in self.names}
+        self.data = view[offset:offset + data_size]
+        self._strings = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for column in [
+            self.string_offsets,
+            self.refs,
+            self.starts,
+            *self.columns.values(),
+            self.data,
+        ]:
+            column.release()
+        self._strings = None
+        self.columns = {}
+        self.buffer.close()
+
+    @property
+    def strings(self):
+        """
+        the string table, decoded (once) when first needed.
+        """
+        if self._strings is None:
+            data = self.data
+            offsets = self.string_offsets
+            self._strings = [
+                str(data[offsets[i]:offsets[i + 1]], "utf-8")
+                for i in range(len(offsets) - 1)
+            ]
+        return self._strings
+
+    def sentences(self):
+        """
+        returns the sentences with their rows (each distinct string shared).
+        """
+        strings = self.strings
+        starts = self.starts
+        sentences = []
+        for i in range(self.sentence_count):
+            sentence = Sentence(strings[self.refs[i]])
+            start, end = starts[i], starts[i + 1]
+            for name, column in self.columns.items():
+                values = column[start:end]  # a view, not a copy
+                if name in STRING_ROWS:
+                    values = [strings[value] for value in values]
+                elif name == "flags":
+                    values = [DECODED_FLAGS[value] for value in values]
+                else:
+                    values = values.tolist()
+                setattr(sentence, name, values)
+            sentences.append(sentence)
+        return sentences
+
+
+def read_columnar(filename):
+    with ColumnarFile(filename) as columnar:
+        return columnar.sentences(), columnar.names
+
+
+def interlinear_names(filename):
+    """
+    returns the rows of an interlinear text file in the order they're written.
+    """
+    names = []
+    with open(filename) as f:
+        for line in f:
+            if not line.strip():
+                if names:
+                    break
+                continue
+            names.append(line.split(maxsplit=1)[0].rsplit(".", 1)[1])
+    return names
+
+
+if __name__ == "__main__":
+    from interlinear import read_interlinear, write_interlinear
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "filenames",
+        nargs="+",
+        help="`.col` files to convert to text or text files to `.col`",
+    )
+    args = parser.parse_args()
+
+    for filename in args.filenames:
+        if filename.endswith(".col"):
+            sentences, names = read_columnar(filename)
+            output_filename = filename[:-len(".col")] + ".txt"
+            write_interlinear(sentences, names, output_filename)
+        else:
+            sentences = read_interlinear(filename)
+            output_filename = filename[:-len(".txt")] + ".col"
+            write_columnar(sentences, interlinear_names(filename), output_filename)
+        print(f"{filename} -> {output_filename}")
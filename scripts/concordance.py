@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+"""
+a corpus-wide concordance: where each lemma (and each of its forms) occurs.
+
+The index is built from the `exposures` files into `cache/concordance.idx` and
+memory-mapped when queried. The layout (little-endian) is `MAGIC`, the
+sentence, lemma, form and posting counts and the string table size, then:
+
+    sentences  (ref offset, ref length, text offset, text length) each
+    lemmas     (name offset, name length, first form, end form) each, in
+               collation order
+    forms      (name offset, name length, first posting, end posting) each,
+               sorted by collation within their lemma
+    postings   (sentence, position) each, sorted, for each form in turn
+    strings    the UTF-8 string table the offsets above point into
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import time
+
+from chapters import corpus_chapters
+from collation import sort_key
+from interlinear import analysis_filename, read_interlinear
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+
+
+CHAPTERS = corpus_chapters()
+
+FILENAME = "cache/concordance.idx"
+
+MAGIC = b"LGPSICC1"
+HEADER = struct.Struct("<8s5I")
+SENTENCE = struct.Struct("<4I")
+LEMMA = struct.Struct("<4I")
+FORM = struct.Struct("<4I")
+POSTING = struct.Struct("<IH")
+
+
+class ConcordanceBuilder:
+    """
+    collects postings from chapters' sentences (added in order) and writes
+    the index.
+    """
+
+    def __init__(self):
+        self.sentences = []
+        self.postings = {}
+
+    def add(self, sentences):
+        for sentence in sentences:
+            sentence_num = len(self.sentences)
+            self.sentences.append((sentence.ref, " ".join(sentence.text)))
+            for position, (norm, lemma) in enumerate(
+                zip(sentence.norm, sentence.lemma)
+            ):
+                self.postings.setdefault(lemma, {}).setdefault(norm, []).append(
+                    (sentence_num, position)
+                )
+
+    def add_chapter(self, chapter_num):
+        input_filename = analysis_filename(chapter_num, "exposures")
+        with PROFILE.chapter("concordance", chapter_num, [input_filename]) as record:
+            sentences = read_interlinear(input_filename)
+            self.add(sentences)
+            record["tokens"] += count_tokens(sentences)
+
+    def write(self, filename=FILENAME):
+        strings = bytearray()
+        string_offsets = {}
+
+        def string(s):
+            if s not in string_offsets:
+                encoded = s.encode("utf-8")
+                string_offsets[s] = (len(strings), len(encoded))
+                strings.extend(encoded)
+            return string_offsets[s]
+
+        sentence_table = bytearray()
+        for ref, text in self.sentences:
+            sentence_table += SENTENCE.pack(*string(ref), *string(text))
+
+        lemma_table = bytearray()
+        form_table = bytearray()
+        posting_table = bytearray()
+        form_count = 0
+        posting_count = 0
+        for lemma in sorted(self.postings, key=sort_key):
+            forms = self.postings[lemma]
+            lemma_table += LEMMA.pack(
+                *string(lemma), form_count, form_count + len(forms)
+            )
+            for form in sorted(forms, key=sort_key):
+                postings = forms[form]  # already sorted, being added in order
+                form_table += FORM.pack(
+                    *string(form), posting_count, posting_count + len(postings)
+                )
+                for posting in postings:
+                    posting_table += POSTING.pack(*posting)
+                form_count += 1
+                posting_count += len(postings)
+
+        with open(filename + ".tmp", "wb") as g:
+            g.write(
+                HEADER.pack(
+                    MAGIC,
+                    len(self.sentences),
+                    len(self.postings),
+                    form_count,
+                    posting_count,
+                    len(strings),
+                )
+            )
+            for table in [
+                sentence_table,
+                lemma_table,
+                form_table,
+                posting_table,
+                strings,
+            ]:
+                g.write(table)
+        os.replace(filename + ".tmp", filename)
+
+
+def build(chapters=CHAPTERS, filename=FILENAME):
+    builder = ConcordanceBuilder()
+    for chapter_num in chapters:
+        builder.add_chapter(chapter_num)
+    builder.write(filename)
+
+
+def is_stale(chapters=CHAPTERS, filename=FILENAME):
+    """
+    whether the index is missing or older than any of the chapters'
+    `exposures` files.
+    """
+    if not os.path.exists(filename):
+        return True
+    built = os.path.getmtime(filename)
+    return any(
+        os.path.getmtime(analysis_filename(chapter_num, "exposures")) > built
+        for chapter_num in chapters
+    )
+
+
+class Concordance:
+    """
+    a memory-mapped concordance index, for use as a context manager.
+    """
+
+    def __init__(self, filename=FILENAME):
+        with open(filename, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, sentence_count, lemma_count, form_count, posting_count, _ = (
+            HEADER.unpack_from(self.buffer)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a concordance index")
+
+        self.sentence_offset = HEADER.size
+        self.lemma_offset = self.sentence_offset + sentence_count * SENTENCE.size
+        self.form_offset = self.lemma_offset + lemma_count * LEMMA.size
+        self.posting_offset = self.form_offset + form_count * FORM.size
+        self.string_offset = self.posting_offset + posting_count * POSTING.size
+        self.sentence_count = sentence_count
+        self.lemma_count = lemma_count
+        self.form_count = form_count
+        self._lemma_index = None  # decoded when first needed
+        self._form_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.buffer.close()
+
+    def string(self, offset, length):
+        start = self.string_offset + offset
+        return self.buffer[start:start + length].decode("utf-8")
+
+    def sentence(self, sentence_num):
+        """
+        returns the ref and text of the given sentence.
+        """
+        ref_offset, ref_length, text_offset, text_length = SENTENCE.unpack_from(
+            self.buffer, self.sentence_offset + sentence_num * SENTENCE.size
+        )
+        return self.string(ref_offset, ref_length), self.string(
+            text_offset, text_length
+        )
+
+    def _lemma_name(self, lemma_num):
+        name_offset, name_length, _, _ = LEMMA.unpack_from(
+            self.buffer, self.lemma_offset + lemma_num * LEMMA.size
+        )
+        return self.string(name_offset, name_length)
+
+    def lemma_index(self):
+        """
+        returns lemma -> lemma number, decoding the lemma names the first time.
+        """
+        if self._lemma_index is None:
+            self._lemma_index = {
+                self._lemma_name(lemma_num): lemma_num
+                for lemma_num in range(self.lemma_count)
+            }
+        return self._lemma_index
+
+    def form_index(self):
+        """
+        returns form -> form numbers (one per lemma it is a form of), decoding
+        the form names the first time.
+        """
+        if self._form_index is None:
+            self._form_index = {}
+            for form_num in range(self.form_count):
+                self._form_index.setdefault(self._form_name(form_num), []).append(
+                    form_num
+                )
+        return self._form_index
+
+    def lemmas(self):
+        """
+        returns the lemmas in collation order.
+        """
+        return [self._lemma_name(lemma_num) for lemma_num in range(self.lemma_count)]
+
+    def _lemma_forms(self, lemma_num):
+        _, _, first_form, end_form = LEMMA.unpack_from(
+            self.buffer, self.lemma_offset + lemma_num * LEMMA.size
+        )
+        return range(first_form, end_form)
+
+    def _form_range(self, lemma):
+        lemma_num = self.lemma_index().get(lemma)
+        if lemma_num is None:
+            return range(0)
+        return self._lemma_forms(lemma_num)
+
+    def _form_name(self, form_num):
+        name_offset, name_length, _, _ = FORM.unpack_from(
+            self.buffer, self.form_offset + form_num * FORM.size
+        )
+        return self.string(name_offset, name_length)
+
+    def _postings(self, form_num):
+        _, _, first_posting, end_posting = FORM.unpack_from(
+            self.buffer, self.form_offset + form_num * FORM.size
+        )
+        start = self.posting_offset + first_posting * POSTING.size
+        end = self.posting_offset + end_posting * POSTING.size
+        return POSTING.iter_unpack(self.buffer[start:end])
+
+    def forms(self, lemma):
+        """
+        returns the forms of the given lemma in collation order.
+        """
+        return [self._form_name(form_num) for form_num in self._form_range(lemma)]
+
+    def lemma_postings(self, lemma, form=None):
+        """
+        yields the (sentence, position) of each occurrence of the given lemma
+        (only as the given form, if one is) in text order.
+        """
+        form_nums = [
+            form_num for form_num in self._form_range(lemma)
+            if form is None or self._form_name(form_num) == form
+        ]
+        return heapq.merge(*(self._postings(form_num) for form_num in form_nums))
+
+    def form_postings(self, form):
+        """
+        yields the (sentence, position) of each occurrence of the given form
+        (whatever its lemma) in text order.
+        """
+        return heapq.merge(
+            *(self._postings(form_num) for form_num in self.form_index().get(form, []))
+        )
+
+    def first_exposures(self):
+        """
+        returns the (sentence, position) of the first occurrence of each lemma.
+        """
+        return {
+            self._lemma_name(lemma_num): min(
+                next(self._postings(form_num))
+                for form_num in self._lemma_forms(lemma_num)
+            )
+            for lemma_num in range(self.lemma_count)
+        }
+
+    def lines(self, postings, width=40):
+        """
+        yields a concordance line (ref, left context, token, right context)
+        for each (sentence, position), the contexts cut to `width` characters.
+        """
+        for sentence_num, position in postings:
+            ref, text = self.sentence(sentence_num)
+            tokens = text.split(" ")
+            left = " ".join(tokens[:position])[-width:]
+            right = " ".join(tokens[position + 1:])[:width]
+            yield ref, left, tokens[position], right
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build", help=f"build {FILENAME} from every chapter's exposures file"
+    )
+    lemma_parser = subparsers.add_parser("lemma", help="concordance lines for a lemma")
+    lemma_parser.add_argument("lemma")
+    lemma_parser.add_argument("--form", help="only occurrences as this form")
+    form_parser = subparsers.add_parser("form", help="concordance lines for a form")
+    form_parser.add_argument("form")
+    for query_parser in [lemma_parser, form_parser]:
+        query_parser.add_argument(
+            "--width", type=int, default=40, help="characters of context either side"
+        )
+    for command_parser in [build_parser, lemma_parser, form_parser]:
+        profile_arguments(command_parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    if args.command == "build":
+        build()
+    else:
+        start = time.perf_counter()
+        with Concordance() as concordance:
+            if args.command == "lemma":
+                postings = concordance.lemma_postings(args.lemma, args.form)
+            else:
+                postings = concordance.form_postings(args.form)
+            lines = list(concordance.lines(postings, args.width))
+        elapsed = time.perf_counter() - start
+        for ref, left, token, right in lines:
+            print(f"{ref:14} {left:>{args.width}} [{token}] {right}")
+        print(f"{len(lines)} occurrences in {elapsed * 1000:.1f}ms")
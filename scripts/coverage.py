@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""
+how much of a passage's vocabulary is known as of a given chapter.
+
+For each sentence, paragraph or chapter of a `lemma`, `exposures` or plain
+sentence file, gives the fraction of its tokens whose lemma, and whose (lemma,
+form), had been seen by the end of the chapter, and the lemmas that hadn't.
+"""
+
+import argparse
+from collections import defaultdict
+import time
+
+import numpy as np
+
+from chapter_data import read_delta
+from chapters import corpus_chapters
+from collation import sort_key
+from exposure_engine import Vocabulary, grown
+from interlinear import read_interlinear, read_text
+from profiling import profile_arguments, start_profile
+from utils import load_script
+
+
+CHAPTERS = corpus_chapters()
+
+# the lemma `lemmatise.py` gives a form it can't resolve, which isn't counted
+UNRESOLVED = "-"
+
+# how a ref is cut down to the passage it belongs to
+PASSAGES = {
+    "sentence": lambda ref: ref,
+    "paragraph": lambda ref: ref.rsplit(".", 1)[0],
+    "chapter": lambda ref: ref.split(".", 1)[0],
+}
+
+
+class Coverage:
+    """
+    the lemmas and (lemma, form) pairs of the given chapters, each with the
+    chapter it is first seen in.
+    """
+
+    def __init__(self, chapters=CHAPTERS):
+        self.lemmas = Vocabulary()
+        self.forms = Vocabulary()
+        self.lemma_first_seen = np.zeros(0, dtype=np.int32)
+        self.form_first_seen = np.zeros(0, dtype=np.int32)
+        for chapter_num in chapters:
+            self.add(chapter_num, read_delta(chapter_num))
+        self.masks = {}
+
+    def add(self, chapter_num, delta):
+        lemma_count = len(self.lemmas)
+        form_count = len(self.forms)
+        lemmas = {
+            lemma: forms
+            for lemma, forms in delta["lemmas"].items()
+            if lemma != UNRESOLVED
+        }
+        self.lemmas.ids(list(lemmas))
+        self.forms.ids(
+            [(lemma, form) for lemma, forms in lemmas.items() for form in forms]
+        )
+        self.lemma_first_seen = grown(self.lemma_first_seen, len(self.lemmas))
+        self.lemma_first_seen[lemma_count:] = chapter_num
+        self.form_first_seen = grown(self.form_first_seen, len(self.forms))
+        self.form_first_seen[form_count:] = chapter_num
+
+    def known(self, as_of):
+        """
+        returns masks over the lemma and form ids of those seen by the end of
+        the given chapter, each with a final False for ids of -1 (not seen at
+        all).
+        """
+        if as_of not in self.masks:
+            self.masks[as_of] = (
+                np.append(self.lemma_first_seen <= as_of, False),
+                np.append(self.form_first_seen <= as_of, False),
+            )
+        return self.masks[as_of]
+
+    def coverage(self, lemmas, norms, as_of):
+        """
+        returns the coverage, as of the given chapter, of the tokens with the
+        given (parallel) lemmas and norms, leaving out unresolved ones.
+        """
+        resolved = [
+            (lemma, norm) for lemma, norm in zip(lemmas, norms) if lemma != UNRESOLVED
+        ]
+        lemmas = [lemma for lemma, _ in resolved]
+        norms = [norm for _, norm in resolved]
+        known_lemmas, known_forms = self.known(as_of)
+        lemma_index = self.lemmas.index
+        form_index = self.forms.index
+        lemma_known = known_lemmas[
+            np.fromiter(
+                (lemma_index.get(lemma, -1) for lemma in lemmas),
+                dtype=np.int64,
+                count=len(lemmas),
+            )
+        ]
+        form_known = known_forms[
+            np.fromiter(
+                (form_index.get(pair, -1) for pair in zip(lemmas, norms)),
+                dtype=np.int64,
+                count=len(lemmas),
+            )
+        ]
+        tokens = len(lemmas)
+        known_lemma_tokens = int(lemma_known.sum())
+        known_form_tokens = int(form_known.sum())
+        return {
+            "tokens": tokens,
+            "known_lemma_tokens": known_lemma_tokens,
+            "known_form_tokens": known_form_tokens,
+            "lemma_coverage": known_lemma_tokens / tokens if tokens else 1.0,
+            "form_coverage": known_form_tokens / tokens if tokens else 1.0,
+            "unknown_lemmas": sorted(
+                {
+                    lemma
+                    for lemma, known in zip(lemmas, lemma_known.tolist())
+                    if not known
+                },
+                key=sort_key,
+            ),
+        }
+
+    def passages(self, sentences, as_of, by="sentence"):
+        """
+        yields (ref, coverage) for each passage of the given sentences.
+        """
+        passage_refs = []
+        lemmas = defaultdict(list)
+        norms = defaultdict(list)
+        for sentence in sentences:
+            ref = PASSAGES[by](sentence.ref)
+            if ref not in lemmas:
+                passage_refs.append(ref)
+            lemmas[ref].extend(sentence.lemma)
+            norms[ref].extend(sentence.norm)
+        for ref in passage_refs:
+            yield ref, self.coverage(lemmas[ref], norms[ref], as_of)
+
+
+def read_passages(filename):
+    """
+    reads the sentences of an interlinear file with norm and lemma rows or,
+    from a sentence file (a ref and then the tokens per line), normalises and
+    lemmatises them as `add-norm.py` and `lemmatise.py` would.
+    """
+    if filename.endswith(".col"):
+        return read_interlinear(filename)
+    with open(filename) as f:
+        first_label = next((line.split()[0] for line in f if line.strip()), "")
+    if first_label.rsplit(".", 1)[-1].isalpha():  # e.g. `001.1.01.1.text`
+        return read_interlinear(filename)
+
+    sentences = read_text(filename)
+    add_norm = load_script("add-norm")
+    lemmatise = load_script("lemmatise")
+    for sentence in sentences:
+        add_norm.normalise_sentence(sentence)
+    problems = defaultdict(list)
+    with lemmatise.open_morpheus() as morpheus:
+        lemmatise.lemmatise(sentences, morpheus, problems)
+    lemmatise.print_problems(problems)
+    return sentences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("filenames", metavar="FILENAME", nargs="+")
+    parser.add_argument(
+        "--as-of", type=int, required=True, help="the chapter the reader has read up to"
+    )
+    parser.add_argument(
+        "--by",
+        choices=list(PASSAGES),
+        default="sentence",
+        help="the passages to give coverage for",
+    )
+    parser.add_argument(
+        "--rank", action="store_true", help="list the passages best covered first"
+    )
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    sentences = [
+        sentence for filename in args.filenames for sentence in read_passages(filename)
+    ]
+    coverage = Coverage(
+        [chapter_num for chapter_num in CHAPTERS if chapter_num <= args.as_of]
+    )
+
+    start = time.perf_counter()
+    results = list(coverage.passages(sentences, args.as_of, args.by))
+    elapsed = time.perf_counter() - start
+    if args.rank:
+        results.sort(
+            key=lambda result: (
+                -result[1]["lemma_coverage"],
+                -result[1]["form_coverage"],
+            )
+        )
+    for ref, result in results:
+        print(
+            f"{ref:14} {result['lemma_coverage']:7.1%}"
+            f" {result['form_coverage']:7.1%} {result['tokens']:5}"
+            f"  {' '.join(result['unknown_lemmas'])}".rstrip()
+        )
+    print(f"{len(results)} passages in {elapsed * 1000:.1f}ms")
@@ -0,0 +1,117 @@
+"""
+counting a chapter's norms and lemmas as NumPy arrays rather than token by
+token.
+
+Strings are interned to integer ids (`Vocabulary`) and the running exposure
+numbers (`Exposures`) and per-chapter counts (`chapter_counts`) are worked out
+over arrays of those ids.
+"""
+
+import numpy as np
+
+
+class Vocabulary:
+    """
+    strings interned to consecutive integer ids, in order of first occurrence.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def ids(self, strings):
+        """
+        returns the ids of the given strings as an array, interning any new
+        ones.
+        """
+        index = self.index
+        for string in dict.fromkeys(strings):  # distinct, in order
+            if string not in index:
+                index[string] = len(self.strings)
+                self.strings.append(string)
+        return np.fromiter(
+            map(index.__getitem__, strings), dtype=np.int64, count=len(strings)
+        )
+
+
+def grown(counts, size):
+    """
+    the counts extended with zeros to the given size.
+    """
+    if len(counts) < size:
+        return np.concatenate(
+            [counts, np.zeros(size - len(counts), dtype=counts.dtype)]
+        )
+    return counts
+
+
+def running(ids, counts):
+    """
+    returns each token's occurrence number, counting on from `counts` (indexed
+    by id and updated in place).
+    """
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    starts = np.flatnonzero(np.diff(sorted_ids, prepend=-1))
+    rank = np.arange(len(ids)) - np.repeat(starts, np.diff(np.r_[starts, len(ids)]))
+    numbers = np.empty(len(ids), dtype=np.int64)
+    numbers[order] = counts[sorted_ids] + rank + 1
+    counts += np.bincount(ids, minlength=len(counts))
+    return numbers
+
+
+class Exposures:
+    """
+    how many times each norm and lemma has been seen so far.
+    """
+
+    def __init__(self):
+        self.norms = Vocabulary()
+        self.lemmas = Vocabulary()
+        self.norm_counts = np.zeros(0, dtype=np.int64)
+        self.lemma_counts = np.zeros(0, dtype=np.int64)
+
+    def seen_norm(self, norm):
+        return (
+            int(self.norm_counts[self.norms.index[norm]])
+            if norm in self.norms.index
+            else 0
+        )
+
+    def seen_lemma(self, lemma):
+        return (
+            int(self.lemma_counts[self.lemmas.index[lemma]])
+            if lemma in self.lemmas.index
+            else 0
+        )
+
+    def add(self, norms, lemmas):
+        """
+        counts the given (parallel) norms and lemmas, returning the exposure
+        number of each as arrays.
+        """
+        norm_ids = self.norms.ids(norms)
+        lemma_ids = self.lemmas.ids(lemmas)
+        self.norm_counts = grown(self.norm_counts, len(self.norms))
+        self.lemma_counts = grown(self.lemma_counts, len(self.lemmas))
+        return running(norm_ids, self.norm_counts), running(
+            lemma_ids, self.lemma_counts
+        )
+
+
+def chapter_counts(lemma_ids, form_ids):
+    """
+    returns the distinct (lemma, form) pairs of a chapter's tokens, as arrays
+    of lemma ids and form ids sorted by lemma id then form id, with the
+    number of tokens of each, plus where each lemma's pairs start and the
+    number of tokens of each lemma.
+    """
+    pairs = (lemma_ids << 32) | form_ids
+    pairs, pair_counts = np.unique(pairs, return_counts=True)
+    pair_lemma_ids = pairs >> 32
+    starts = np.flatnonzero(np.diff(pair_lemma_ids, prepend=-1))
+    lemma_counts = np.add.reduceat(pair_counts, starts) if len(pairs) else pair_counts
+    return pair_lemma_ids, pairs & 0xFFFFFFFF, pair_counts, starts, lemma_counts
@@ -4,81 +4,120 @@
 generates cummulative data about each chapter
 """
 
-from collections import Counter, defaultdict
-import json
-
-from pyuca import Collator
-coll = Collator()
-
-
-cumulative_lemma_last_seen = {}
-cumulative_lemma_form_last_seen = {}
-cumulative_lemma_count = Counter()
-cumulative_lemma_form_count = defaultdict(Counter)
-
-for chapter_num in range(1, 20):
-    input_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.lemma.txt"
-    output_filename = f"analysis/lgpsi.{chapter_num:03d}.json"
-
-    chapter_lemma_count = Counter()
-    chapter_lemma_form_count = defaultdict(Counter)
-    chapter_form_count = Counter()
-
-    chapter_new_lemma_count = Counter()
-    chapter_new_form_count = Counter()
-
-    with open(input_filename) as f:
-        for line in f:
-
-            if ".norm " in line:
-                norm_list = line.strip().split()
-
-            if ".lemma " in line:
-                lemma_list = line.strip().split()
-
-                for norm, lemma in zip(norm_list[1:], lemma_list[1:]):
-                    chapter_lemma_count[lemma] += 1
-                    chapter_lemma_form_count[lemma][norm] += 1
-                    chapter_form_count[(lemma, norm)] += 1
-
-                    if lemma not in cumulative_lemma_last_seen:
-                        chapter_new_lemma_count[lemma] += 1
-                    if (lemma, norm) not in cumulative_lemma_form_last_seen:
-                        chapter_new_form_count[(lemma, norm)] += 1
-
-    data = {
-        "lemma_types": len(chapter_lemma_count.keys()),
-        "lemma_tokens": sum(chapter_lemma_count.values()),
-        "form_types": len(chapter_form_count.keys()),
-        "form_tokens": sum(chapter_form_count.values()),
-        "new_lemma_types": len(chapter_new_lemma_count.keys()),
-        "new_lemma_tokens": sum(chapter_new_lemma_count.values()),
-        "new_form_types": len(chapter_new_form_count.keys()),
-        "new_form_tokens": sum(chapter_new_form_count.values()),
-        "lemmas": {}
+import argparse
+
+import numpy as np
+
+from chapter_data import (
+    Cumulative,
+    checkpoints,
+    delta_filename,
+    read_delta,
+    write_delta,
+)
+from chapters import chapters_argument, corpus_chapters
+from collation import sort_key
+from exposure_engine import Vocabulary, chapter_counts
+from interlinear import analysis_filename, read_interlinear
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+
+
+CHAPTERS = corpus_chapters()
+
+# the lemmas and forms seen by this process (the ids only matter within a chapter)
+VOCABULARY = Vocabulary()
+
+
+def chapter_delta(sentences, cumulative):
+    """
+    returns the delta for a chapter's sentences given what's been seen before.
+    """
+    lemma_ids, form_ids, pair_counts, starts, lemma_counts = chapter_counts(
+        VOCABULARY.ids([lemma for sentence in sentences for lemma in sentence.lemma]),
+        VOCABULARY.ids([norm for sentence in sentences for norm in sentence.norm]),
+    )
+    strings = VOCABULARY.strings
+    lemmas = [strings[lemma_id] for lemma_id in lemma_ids[starts].tolist()]
+    pairs = list(zip(
+        [strings[lemma_id] for lemma_id in lemma_ids.tolist()],
+        [strings[form_id] for form_id in form_ids.tolist()],
+    ))
+
+    new_lemmas = np.array(
+        [lemma not in cumulative.lemma_last_seen for lemma in lemmas], dtype=bool
+    )
+    new_forms = np.array(
+        [pair not in cumulative.lemma_form_last_seen for pair in pairs], dtype=bool
+    )
+
+    chapter_lemma_form_count = {lemma: {} for lemma in lemmas}
+    for (lemma, form), count in zip(pairs, pair_counts.tolist()):
+        chapter_lemma_form_count[lemma][form] = count
+
+    tokens = int(pair_counts.sum())
+    return {
+        "lemma_types": len(lemmas),
+        "lemma_tokens": tokens,
+        "form_types": len(pairs),
+        "form_tokens": tokens,
+        "new_lemma_types": int(new_lemmas.sum()),
+        "new_lemma_tokens": int(lemma_counts[new_lemmas].sum()),
+        "new_form_types": int(new_forms.sum()),
+        "new_form_tokens": int(pair_counts[new_forms].sum()),
+        "lemmas": {
+            lemma: {
+                form: chapter_lemma_form_count[lemma][form]
+                for form in sorted(chapter_lemma_form_count[lemma], key=sort_key)
+            }
+            for lemma in sorted(chapter_lemma_form_count, key=sort_key)
+        },
     }
 
-    for lemma in sorted(chapter_lemma_count.keys() | cumulative_lemma_count.keys(), key=coll.sort_key):
-        lemma_data = {}
-        lemma_data["cumulative_last_seen"] = cumulative_lemma_last_seen.get(lemma, 0)
-        lemma_data["cumulative_lemma_count"] = cumulative_lemma_count[lemma]
-        lemma_data["chapter_lemma_count"] = chapter_lemma_count[lemma]
-        lemma_data["forms"] = {}
-
-        for form in cumulative_lemma_form_count[lemma].keys() | chapter_lemma_form_count[lemma].keys():
-            form_data = {}
-            form_data["cumulative_lemma_form_last_seen"] = cumulative_lemma_form_last_seen.get((lemma, form), 0)
-            form_data["cumulative_lemma_form_count"] = cumulative_lemma_form_count[lemma][form]
-            form_data["chapter_lemma_form_count"] = chapter_lemma_form_count[lemma][form]
-            lemma_data["forms"][form] = form_data
-        data["lemmas"][lemma] = lemma_data
-
-    with open(output_filename, "w") as g:
-        json.dump(data, g, ensure_ascii=False)
-
-    for lemma in chapter_lemma_count:
-        cumulative_lemma_last_seen[lemma] = chapter_num
-        for form in chapter_lemma_form_count[lemma]:
-            cumulative_lemma_form_last_seen[(lemma, form)] = chapter_num
-            cumulative_lemma_form_count[lemma][form] += chapter_lemma_form_count[lemma][form]
-        cumulative_lemma_count[lemma] += chapter_lemma_count[lemma]
+
+def process_chapter(chapter_num, cumulative, write=True):
+    """
+    writes the delta for the given chapter and adds it to `cumulative` (or, if
+    `write` is false, as when just catching up, only adds the existing delta).
+    """
+    input_filename = analysis_filename(chapter_num, "lemma")
+
+    with PROFILE.chapter(
+        "generate-chapter-data", chapter_num,
+        [input_filename if write else delta_filename(chapter_num)],
+        [delta_filename(chapter_num)] if write else [],
+    ) as record:
+        if write:
+            sentences = read_interlinear(input_filename)
+            delta = chapter_delta(sentences, cumulative)
+            write_delta(chapter_num, delta)
+            record["tokens"] += count_tokens(sentences)
+        else:
+            delta = read_delta(chapter_num)
+
+        cumulative.add(chapter_num, delta)
+
+
+def process_chapters(only=None, rewrite=(), force=False):
+    """
+    writes the deltas of the chapters (of those in `only`) that are out of
+    date or in `rewrite`, resuming from the snapshot of what had been seen
+    before the first of them, and returns the chapters written.
+    """
+    return checkpoints().run(
+        CHAPTERS, process_chapter, lambda: (Cumulative(),), only, rewrite, force
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rewrite every chapter, ignoring the snapshots",
+    )
+    chapters_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    process_chapters(only=args.chapters, force=args.force)
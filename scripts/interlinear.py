@@ -0,0 +1,109 @@
+"""
+an in-memory token table for sentences and its (de)serialisation from/to the
+GLTP sentence files in `text` and the interlinear files in `analysis`.
+
+The interlinear files are text unless `LGPSI_FORMAT` is `columnar`, when
+they are written (and read) in the binary format of `columnar.py` instead.
+"""
+
+import os
+
+from profiling import PROFILE
+from utils import print_interlinear
+
+
+FORMAT_ENV = "LGPSI_FORMAT"
+
+ANALYSIS_EXTENSION = ".col" if os.environ.get(FORMAT_ENV) == "columnar" else ".txt"
+
+
+def analysis_filename(chapter_num, name):
+    """
+    the interlinear file of a chapter with the given rows, e.g. `norm`.
+    """
+    return f"analysis/lgpsi.sent.{chapter_num:03d}.{name}{ANALYSIS_EXTENSION}"
+
+
+class Sentence:
+    """
+    the tokens of a sentence with a parallel list per row: `text`, `norm`,
+    `flags`, `lemma` (all strings) and `normexp`, `lemmaexp` (ints). Rows not
+    produced yet are None.
+    """
+
+    __slots__ = ["ref", "text", "norm", "flags", "lemma", "normexp", "lemmaexp"]
+
+    INT_ROWS = {"normexp", "lemmaexp"}
+
+    def __init__(self, ref, text=None):
+        self.ref = ref
+        self.text = text
+        self.norm = None
+        self.flags = None
+        self.lemma = None
+        self.normexp = None
+        self.lemmaexp = None
+
+    def rows(self, names):
+        """
+        returns the given rows as token lists, each labelled with its ref.
+        """
+        return [
+            [f"{self.ref}.{name}", *map(str, getattr(self, name))] for name in names
+        ]
+
+
+def read_text(filename):
+    """
+    reads the sentences of a GLTP file (a ref and then the tokens per line).
+    """
+    sentences = []
+    with open(filename) as f:
+        for line in f:
+            ref, *text = line.split()
+            sentences.append(Sentence(ref, text))
+    return sentences
+
+
+def write_text(sentences, filename):
+    with open(filename, "w") as g:
+        for sentence in sentences:
+            print(f"{sentence.ref} {' '.join(sentence.text)}", file=g)
+
+
+def read_interlinear(filename):
+    """
+    reads the sentences of an interlinear file with whatever rows it has.
+    """
+    if filename.endswith(".col"):
+        from columnar import read_columnar
+        with PROFILE.section("interlinear.read"):
+            return read_columnar(filename)[0]
+    sentences = []
+    sentence = None
+    with PROFILE.section("interlinear.read"), open(filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            label, *tokens = line.split()
+            ref, name = label.rsplit(".", 1)
+            if sentence is None or sentence.ref != ref:
+                sentence = Sentence(ref)
+                sentences.append(sentence)
+            if name in Sentence.INT_ROWS:
+                tokens = [int(token) for token in tokens]
+            setattr(sentence, name, tokens)
+    return sentences
+
+
+def write_interlinear(sentences, names, filename):
+    """
+    writes the given rows of each sentence as an interlinear file.
+    """
+    if filename.endswith(".col"):
+        from columnar import write_columnar
+        with PROFILE.section("interlinear.write"):
+            return write_columnar(sentences, names, filename)
+    with PROFILE.section("interlinear.write"), open(filename, "w") as g:
+        for sentence in sentences:
+            print_interlinear(sentence.rows(names), g)
@@ -1,72 +1,169 @@
 #!/usr/bin/env python3
 
+import argparse
 from collections import defaultdict
-import unicodedata
+import os
 
-from morpheus import Morpheus
-from utils import print_interlinear
+from chapters import chapters_argument, lemmatised_chapters, selected
+from interlinear import analysis_filename, read_interlinear, write_interlinear
+from morpheus import LocalBackend, Morpheus
+from overrides import LemmaOverrides
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+from utils import jobs_argument, map_chapters
 
 from greek_accentuation.characters import strip_length
-import yaml
-
-
-try:
-    with open("manual-data/lemma_overrides.yaml") as f:
-        lemma_overrides = yaml.safe_load(f)
-except FileNotFoundError:
-    lemma_overrides = {}
-
-
-problems = defaultdict(list)
-with Morpheus("cache/morpheus.json") as morpheus:
-
-    for chapter_num in range(1, 6):
-        input_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.norm.txt"
-        output_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.lemma.txt"
-
-        with open(input_filename) as f, open(output_filename, "w") as g:
-            for line in f:
-                if ".text" in line:
-                    text_list = line.strip().split()
-                if ".flags" in line:
-                    flags_list = line.strip().split()
-                if ".norm" in line:
-                    ref = line.split(".norm")[0]
-                    norm_list = line.strip().split()
-                    lemma_list = [f"{ref}.lemma"]
-
-                    for norm in line.split()[1:]:
-
-                        # see if we have an override
-
-                        lemma = None
-                        prefix = None
-                        if norm in lemma_overrides:
-                            lemma = lemma_overrides[norm].get("default")
-                            for k, v in lemma_overrides[norm].items():
-                                if not isinstance(k, str):
-                                    print(f"*** {k} is not a string (under {norm})")
-                                    break
-                                if k != "default" and ref.startswith(k):
-                                    if prefix is None or len(k) > len(prefix):
-                                        prefix = k
-                                        lemma = v
-
-                        # otherwise check morpheus
-
-                        if lemma is None:
-                            lemmas, cache_hit = morpheus.lookup(
-                                strip_length(norm), lang="grc", engine="morpheusgrc"
-                            )
-                            if len(lemmas) != 1:
-                                problems[(norm, "|".join(sorted(lemmas)))].append(ref)
-                                lemma = "-"
-                            else:
-                                lemma = lemmas[0]
-                        lemma_list.append(lemma)
-
-                    print_interlinear([text_list, norm_list, flags_list, lemma_list], g)
-
-
-for norm, lemmas in problems.keys():
-    print(norm, lemmas.split("|"), problems[(norm, lemmas)])
+
+
+lemma_overrides = LemmaOverrides.load()
+
+
+CHAPTERS = lemmatised_chapters()
+
+CACHE_FILENAME = "cache/morpheus.sqlite"
+
+# what the offline backend answers from
+LOCAL_SEED_FILENAMES = ["cache/morpheus.json"]
+
+
+def local_backend():
+    """
+    an offline backend answering from the JSON Morpheus cache and, for forms
+    that lacks, the lemmas the overrides give them.
+    """
+    extra = {}
+    for norm, lemmas in lemma_overrides.lemmas_by_norm().items():
+        extra.setdefault(strip_length(norm), lemmas)
+    return LocalBackend.seeded(LOCAL_SEED_FILENAMES, extra)
+
+
+def open_morpheus(read_only=False):
+    """
+    opens Morpheus at `MORPHEUS_ENDPOINT` (or the public service) or, if
+    `MORPHEUS_BACKEND` is `local`, offline.
+    """
+    return Morpheus(
+        CACHE_FILENAME,
+        endpoint=os.environ.get("MORPHEUS_ENDPOINT"),
+        read_only=read_only,
+        backend=(
+            local_backend() if os.environ.get("MORPHEUS_BACKEND") == "local" else None
+        ),
+    )
+
+
+def lemmatise(sentences, morpheus, problems):
+    """
+    sets the lemma row of each sentence from the overrides or, failing that,
+    Morpheus, noting any forms Morpheus can't resolve in `problems`.
+    """
+
+    # first pass: apply overrides and collect what's left for morpheus
+
+    forms = []
+    for sentence in sentences:
+        sentence.lemma = []
+        for norm in sentence.norm:
+            lemma = lemma_overrides.resolve(norm, sentence.ref)
+            if lemma is None:
+                forms.append(strip_length(norm))
+            sentence.lemma.append(lemma)
+
+    # otherwise check morpheus (all cache misses at once)
+
+    with PROFILE.section("morpheus"):
+        analyses = morpheus.lookup_many(forms, lang="grc", engine="morpheusgrc")
+
+    for sentence in sentences:
+        for i, norm in enumerate(sentence.norm):
+            if sentence.lemma[i] is None:
+                lemmas = analyses[strip_length(norm)]
+                if len(lemmas) != 1:
+                    problems[(norm, "|".join(sorted(lemmas)))].append(sentence.ref)
+                    sentence.lemma[i] = "-"
+                else:
+                    sentence.lemma[i] = lemmas[0]
+
+
+def process_chapter(chapter_num, morpheus, problems):
+    input_filename = analysis_filename(chapter_num, "norm")
+    output_filename = analysis_filename(chapter_num, "lemma")
+
+    with PROFILE.chapter(
+        "lemmatise", chapter_num, [input_filename], [output_filename]
+    ) as record:
+        sentences = read_interlinear(input_filename)
+        lemmatise(sentences, morpheus, problems)
+        write_interlinear(
+            sentences, ["text", "norm", "flags", "lemma"], output_filename
+        )
+        record["tokens"] += count_tokens(sentences)
+
+
+def process_chapter_snapshot(chapter_num):
+    """
+    lemmatises a chapter in a worker process against a read-only snapshot of
+    the Morpheus cache, returning the chapter's problems, the new lookups and
+    the counters (including which overrides fired) for the parent to merge.
+    """
+    problems = defaultdict(list)
+    lemma_overrides.fired.clear()
+    with open_morpheus(read_only=True) as morpheus:
+        process_chapter(chapter_num, morpheus, problems)
+    return (
+        dict(problems),
+        morpheus.cache.new_entries,
+        morpheus.calls,
+        morpheus.errors,
+        morpheus.cache_hits,
+        lemma_overrides.fired,
+    )
+
+
+def process_chapters(chapters, morpheus, problems, jobs=1):
+    if jobs == 1:
+        for chapter_num in chapters:
+            process_chapter(chapter_num, morpheus, problems)
+        return
+
+    # merged in chapter order so the cache and problems end up as if serial
+    results = map_chapters("lemmatise", "process_chapter_snapshot", chapters, jobs)
+    for chapter_problems, new_entries, calls, errors, cache_hits, fired in results:
+        morpheus.cache.update(new_entries)
+        morpheus.calls += calls
+        morpheus.errors += errors
+        morpheus.cache_hits += cache_hits
+        lemma_overrides.fired.update(fired)
+        for key, refs in chapter_problems.items():
+            problems[key].extend(refs)
+
+
+def print_problems(problems):
+    for norm, lemmas in problems.keys():
+        print(norm, lemmas.split("|"), problems[(norm, lemmas)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help=(
+            "answer cache misses in process from the JSON cache and overrides"
+            " (as MORPHEUS_BACKEND=local)"
+        ),
+    )
+    chapters_argument(parser)
+    jobs_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+    if args.offline:
+        os.environ["MORPHEUS_BACKEND"] = "local"  # so worker processes are too
+
+    problems = defaultdict(list)
+    with open_morpheus() as morpheus:
+        process_chapters(
+            selected(CHAPTERS, args.chapters), morpheus, problems, args.jobs
+        )
+
+    print_problems(problems)
@@ -1,19 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+the Morphology API client and its cache.
+
+Each cache entry has a state: `analysed` (the service gave lemmas),
+`no-analysis` (it answered with none) or `error` (the lookup failed), and
+when it was checked. Answers are kept for good; failures only answer lookups
+(as no lemmas) for `ERROR_TTL` seconds, after which the form is looked up
+again, so an outage doesn't stay in the cache. `./scripts/morpheus.py refresh
+--errors-only` looks up every failed form again at once.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os.path
+import sqlite3
 import sys
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from profiling import PROFILE
+from utils import load_script
 
-class Morpheus:
+
+ANALYSED = "analysed"
+NO_ANALYSIS = "no-analysis"
+ERROR = "error"
+
+STATES = [ANALYSED, NO_ANALYSIS, ERROR]
+
+# how long (in seconds) a failed lookup is trusted before being retried
+ERROR_TTL = int(os.environ.get("MORPHEUS_ERROR_TTL", 60 * 60))
+
+
+def entry_state(lemmas):
+    """
+    the state of a cache entry for the given lemmas (None if the lookup failed).
+    """
+    if lemmas is None:
+        return ERROR
+    return ANALYSED if lemmas else NO_ANALYSIS
+
+
+def answers(state, checked, error_ttl):
+    """
+    whether a cache entry answers a lookup: all do but failures checked more
+    than `error_ttl` seconds ago (or at an unknown time).
+    """
+    return state != ERROR or (checked is not None and time.time() - checked < error_ttl)
+
+
+def make_response(form, lemmas):
+    """
+    builds a service-shaped response for the given lemmas.
+
+    As with the real service, a single analysis has `Body` as an object rather
+    than a list and no analyses means there is no `Body` at all.
+    """
+    annotation = {"about": f"urn:word:{form}"}
+    body = [
+        {"rest": {"entry": {"dict": {"hdwd": {"lang": "grc", "$": lemma}}}}}
+        for lemma in lemmas
+    ]
+    if len(body) == 1:
+        annotation["Body"] = body[0]
+    elif body:
+        annotation["Body"] = body
+    return {"RDF": {"Annotation": annotation}}
+
+
+class HTTPBackend:
+    """
+    the morphology service (or a stand-in for it) over HTTP.
+    """
 
     ENDPOINT = "http://services.perseids.org/bsp/morphologyservice/analysis/word"
 
-    def __init__(self, cache_filename):
+    concurrent = True  # lookups wait on the network so are worth overlapping
+    authoritative = True  # its answers are kept in the cache
+
+    def __init__(
+        self, endpoint=None, max_connections=8, retries=3, backoff=0.5, timeout=10
+    ):
+        self.endpoint = endpoint or self.ENDPOINT
+        self.timeout = timeout
+
+        # one keep-alive pool shared by all lookups, sized so each worker
+        # thread in lookup_many can hold its own connection
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/json"
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def analyse(self, form, **config):
+        """
+        returns the service's response for a form (None if it failed).
+        """
+        params = dict(word=form, **config)
+        try:
+            response = self.session.get(
+                self.endpoint, params=params, timeout=self.timeout
+            )
+            return response.json() if response.ok else None
+        except (
+            requests.RequestException,
+            ValueError,
+        ):  # ValueError if the body isn't JSON
+            return None
+
+    def close(self):
+        self.session.close()
+
+
+class LocalBackend:
+    """
+    an in-process stand-in for the service answering from a table of form to
+    lemmas, with responses in the same shape.
+    """
+
+    concurrent = False
+    authoritative = False  # its answers are only kept for the run
+
+    def __init__(self, analyses):
+        self.analyses = analyses
+
+    @classmethod
+    def seeded(cls, filenames, extra=None):
+        """
+        a backend seeded from the given cache files (those that exist) and
+        then, for forms they don't have, `extra` (form to lemmas).
+        """
+        analyses = {}
+        for filename in filenames:
+            if os.path.exists(filename):
+                cache = open_cache(filename, read_only=True)
+                analyses.update(cache)
+                cache.close()
+        for form, lemmas in (extra or {}).items():
+            analyses.setdefault(form, lemmas)
+        return cls(analyses)
+
+    def analyse(self, form, **config):
+        return make_response(form, self.analyses.get(form, []))
+
+    def close(self):
+        pass
+
+
+class Morpheus:
+
+    def __init__(
+        self,
+        cache_filename,
+        endpoint=None,
+        max_workers=8,
+        retries=3,
+        backoff=0.5,
+        timeout=10,
+        read_only=False,
+        backend=None,
+        error_ttl=ERROR_TTL,
+    ):
         self.cache_filename = cache_filename
-        self.cache = {}
+        self.read_only = read_only
+        self.max_workers = max_workers
+        self.error_ttl = error_ttl
+        self.cache = None
         self.calls = 0
+        self.errors = 0
         self.cache_hits = 0
+        self.backend = backend or HTTPBackend(
+            endpoint, max_workers, retries, backoff, timeout
+        )
 
     def __enter__(self):
         self.load_cache()
@@ -21,52 +193,457 @@ class Morpheus:
 
     def __exit__(self, type, value, tb):
         self.save_cache()
+        self.backend.close()
 
     def load_cache(self):
-        if os.path.exists(self.cache_filename):
-            print("loading Morpheus cache...", end="", file=sys.stderr)
-            with open(self.cache_filename) as f:
-                self.cache = json.load(f)
-            print(f"done with {len(self.cache)} items.", file=sys.stderr)
-        else:
-            print("No cache file so will create on save.")
+        if self.read_only:
+            # as used by worker processes: new entries are left in
+            # `self.cache.new_entries` for the parent to merge
+            self.cache = SnapshotCache(
+                open_cache(
+                    self.cache_filename, read_only=True, error_ttl=self.error_ttl
+                )
+            )
+            return
+        self.cache = open_cache(self.cache_filename, error_ttl=self.error_ttl)
+        print(f"opened Morpheus cache with {len(self.cache)} items.", file=sys.stderr)
+        if not self.backend.authoritative:
+            # a stand-in's answers (e.g. no analysis for a form it doesn't
+            # know) mustn't stop a later run asking the service
+            self.cache = SnapshotCache(self.cache)
 
     def save_cache(self):
+        if self.read_only:
+            self.cache.close()
+            return
+        if not self.backend.authoritative:
+            self.cache.close()
+            print(
+                f"left Morpheus cache as it was after {self.calls} offline calls"
+                f" and {self.cache_hits} cache hits.",
+                file=sys.stderr,
+            )
+            return
         print("saving Morpheus cache...", end="", file=sys.stderr)
-        with open(self.cache_filename, "w") as f:
-            json.dump(self.cache, f)
+        size = len(self.cache)
+        states = self.cache.states()
+        self.cache.close()
         print(
-            f"done with {len(self.cache)} items after {self.calls} calls"
-            f" and {self.cache_hits} cache hits.",
+            f"done with {size} items ({format_states(states)}) after {self.calls} calls"
+            f" ({self.errors} failed) and {self.cache_hits} cache hits.",
             file=sys.stderr,
         )
 
+    def fetch(self, form, **config):
+        """
+        queries the backend for a single form, bypassing the cache, returning
+        its lemmas (None if the lookup failed).
+        """
+        start = time.perf_counter()
+        response = self.backend.analyse(form, **config)
+        PROFILE.observe("morpheus.latency_ms", (time.perf_counter() - start) * 1000)
+        if response is None:
+            PROFILE.count("morpheus.errors")
+            return None
+        body = response.get("RDF", {}).get("Annotation", {}).get("Body", [])
+        if not isinstance(body, list):
+            body = [body]
+
+        lemmas = []
+        for item in body:
+            value = item["rest"]["entry"]["dict"]["hdwd"]["$"]
+            if value == str(value):
+                lemmas.append(value)
+
+        return lemmas
+
     def lookup(self, form, **config):
-        if form in self.cache:
+        lemmas = self.cache.get(form)
+        if lemmas is not None:
             cache_hit = True
             self.cache_hits += 1
-            lemmas = self.cache[form]
+            PROFILE.count("morpheus.hits")
         else:
-            lemmas = []
             cache_hit = False
-            params = dict(word=form, **config)
-            headers = dict(Accept="application/json")
-            response = requests.get(self.ENDPOINT, params=params, headers=headers)
+            lemmas = self.fetch(form, **config)
             self.calls += 1
-            if response.ok:
-                body = (
-                    response.json().get("RDF", {}).get("Annotation", {}).get("Body", [])
+            PROFILE.count("morpheus.misses")
+            self.cache.update({form: lemmas})
+            if lemmas is None:
+                self.errors += 1
+                lemmas = []
+
+        return lemmas, cache_hit
+
+    def fetch_many(self, forms, **config):
+        """
+        queries the backend for each of the given forms, bypassing the cache,
+        concurrently if the backend is one that waits on the network. Returns
+        a dict of form to lemmas (None for those whose lookup failed).
+        """
+        if self.backend.concurrent:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                return dict(
+                    zip(
+                        forms,
+                        executor.map(lambda form: self.fetch(form, **config), forms),
+                    )
                 )
-                if not isinstance(body, list):
-                    body = [body]
-            else:
-                body = []
+        return {form: self.fetch(form, **config) for form in forms}
 
-            for item in body:
-                value = item["rest"]["entry"]["dict"]["hdwd"]["$"]
-                if value == str(value):
-                    lemmas.append(value)
+    def lookup_many(self, forms, **config):
+        """
+        looks up all the given forms, fetching the cache misses concurrently
+        (if the backend is one that waits on the network).
 
-            self.cache[form] = lemmas
+        Returns a dict of form to lemmas. Counters are updated as if each form
+        had been passed to `lookup` in turn, so repeats of a missed form count
+        as cache hits.
+        """
+        forms = list(forms)
+        found = self.cache.get_many(set(forms))
+        misses = list(dict.fromkeys(form for form in forms if form not in found))
 
-        return lemmas, cache_hit
+        if misses:
+            fetched = self.fetch_many(misses, **config)
+            self.cache.update(fetched)
+            failed = [form for form, lemmas in fetched.items() if lemmas is None]
+            self.errors += len(failed)
+            found.update(fetched)
+            found.update({form: [] for form in failed})
+
+        self.calls += len(misses)
+        self.cache_hits += len(forms) - len(misses)
+        PROFILE.count("morpheus.misses", len(misses))
+        PROFILE.count("morpheus.hits", len(forms) - len(misses))
+
+        return {form: found[form] for form in forms}
+
+    def refresh(self, errors_only=False, **config):
+        """
+        looks up again every form in the cache (or, if `errors_only`, every
+        form whose lookup failed), returning how many of them are now in each
+        state. A form that had an answer keeps it if looking it up fails.
+        """
+        failed_before = set(self.cache.forms(ERROR))
+        forms = sorted(failed_before) if errors_only else self.cache.forms()
+        fetched = self.fetch_many(forms, **config)
+        self.calls += len(fetched)
+        self.cache.update({
+            form: lemmas for form, lemmas in fetched.items()
+            if lemmas is not None or form in failed_before
+        })
+        states = dict.fromkeys(STATES, 0)
+        for lemmas in fetched.values():
+            states[entry_state(lemmas)] += 1
+        self.errors += states[ERROR]
+        return states
+
+
+def format_states(states):
+    labels = {ANALYSED: "analysed", NO_ANALYSIS: "with no analysis", ERROR: "failed"}
+    return ", ".join(f"{states.get(state, 0)} {labels[state]}" for state in STATES)
+
+
+class JSONCache:
+    """
+    the original cache format: a single JSON object of form -> lemmas, read in
+    full when opened and rewritten in full when closed.
+
+    It has nowhere to keep failed lookups, so they aren't stored and are
+    retried on the next run.
+    """
+
+    def __init__(self, filename, read_only=False, error_ttl=ERROR_TTL):
+        self.filename = filename
+        self.read_only = read_only
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.data = json.load(f)
+        else:
+            self.data = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data.items())
+
+    def get(self, form):
+        return self.data.get(form)
+
+    def get_many(self, forms):
+        return {form: self.data[form] for form in forms if form in self.data}
+
+    def forms(self, state=None):
+        return [
+            form
+            for form, lemmas in self.data.items()
+            if state in (None, entry_state(lemmas))
+        ]
+
+    def states(self):
+        states = dict.fromkeys(STATES, 0)
+        for lemmas in self.data.values():
+            states[entry_state(lemmas)] += 1
+        return states
+
+    def update(self, entries):
+        self.data.update(
+            {form: lemmas for form, lemmas in entries.items() if lemmas is not None}
+        )
+
+    def close(self):
+        if self.read_only:
+            return
+        # write to a temporary file first so a crash mid-write can't truncate
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(self.data, f)
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+class SQLiteCache:
+    """
+    an indexed on-disk cache: lookups are point queries and new entries are
+    committed as they are added, so nothing is lost if a run dies part way.
+
+    If the database is empty and `migrate_from` names an existing JSON cache,
+    that is imported first.
+
+    Each row has the entry's state and when it was checked. Rows from before
+    there were states are taken to be answers (`analysed`, or `no-analysis`
+    if they have no lemmas) checked at an unknown time.
+    """
+
+    def __init__(
+        self, filename, migrate_from=None, read_only=False, error_ttl=ERROR_TTL
+    ):
+        self.filename = filename
+        self.error_ttl = error_ttl
+        if read_only:
+            self.db = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(filename)
+            with self.db:
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS analyses"
+                    " (form TEXT PRIMARY KEY, lemmas TEXT NOT NULL,"
+                    " state TEXT, checked REAL)"
+                )
+                self.add_states()
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(analyses)")}
+        if "state" in columns:
+            self.columns = "form, lemmas, state, checked"
+        else:  # an old database opened read-only
+            self.columns = (
+                f"form, lemmas, CASE lemmas WHEN '[]' THEN '{NO_ANALYSIS}'"
+                f" ELSE '{ANALYSED}' END AS state, NULL AS checked"
+            )
+        if migrate_from and os.path.exists(migrate_from) and len(self) == 0:
+            print(f"migrating {migrate_from} to {filename}.", file=sys.stderr)
+            self.update(JSONCache(migrate_from).data)
+
+    def add_states(self):
+        """
+        adds the state and checked columns to a database from before them.
+        """
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(analyses)")}
+        if "state" not in columns:
+            self.db.execute("ALTER TABLE analyses ADD COLUMN state TEXT")
+            self.db.execute("ALTER TABLE analyses ADD COLUMN checked REAL")
+        self.db.execute(
+            "UPDATE analyses SET state = CASE lemmas WHEN '[]' THEN ? ELSE ? END"
+            " WHERE state IS NULL",
+            (NO_ANALYSIS, ANALYSED),
+        )
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def __iter__(self):
+        """
+        yields (form, lemmas) for the answers (not the failed lookups).
+        """
+        for form, lemmas, state, _ in self.db.execute(
+            f"SELECT {self.columns} FROM analyses"
+        ):
+            if state != ERROR:
+                yield form, json.loads(lemmas)
+
+    def get(self, form):
+        row = self.db.execute(
+            f"SELECT {self.columns} FROM analyses WHERE form = ?", (form,)
+        ).fetchone()
+        if row is None or not answers(row[2], row[3], self.error_ttl):
+            return None
+        return json.loads(row[1])
+
+    def get_many(self, forms):
+        found = {}
+        forms = list(forms)
+        for i in range(0, len(forms), 500):  # stay under sqlite's variable limit
+            chunk = forms[i:i + 500]
+            query = (
+                f"SELECT {self.columns} FROM analyses"
+                f" WHERE form IN ({','.join('?' * len(chunk))})"
+            )
+            for form, lemmas, state, checked in self.db.execute(query, chunk):
+                if answers(state, checked, self.error_ttl):
+                    found[form] = json.loads(lemmas)
+        return found
+
+    def forms(self, state=None):
+        """
+        the forms in the cache (those in the given state, if one is given).
+        """
+        return [
+            form
+            for form, _, form_state, _ in self.db.execute(
+                f"SELECT {self.columns} FROM analyses"
+            )
+            if state in (None, form_state)
+        ]
+
+    def states(self):
+        """
+        the number of entries in each state.
+        """
+        states = dict.fromkeys(STATES, 0)
+        for state, count in self.db.execute(
+            f"SELECT state, COUNT(*) FROM (SELECT {self.columns} FROM analyses)"
+            " GROUP BY state"
+        ):
+            states[state] = count
+        return states
+
+    def update(self, entries):
+        """
+        stores the given form -> lemmas (None for a failed lookup), as checked
+        now.
+        """
+        checked = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO analyses (form, lemmas, state, checked)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    (form, json.dumps(lemmas or []), entry_state(lemmas), checked)
+                    for form, lemmas in entries.items()
+                ),
+            )
+
+    def close(self):
+        self.db.close()
+
+
+class SnapshotCache:
+    """
+    a view of another (read-only) cache that never writes to it: new entries
+    (None for a failed lookup, which answers as no lemmas for the rest of the
+    run) are just kept in `new_entries`.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.new_entries = {}
+
+    def __len__(self):
+        return len(self.base) + len(self.new_entries)
+
+    def __iter__(self):
+        for form, lemmas in self.base:
+            if form not in self.new_entries:
+                yield form, lemmas
+        for form, lemmas in self.new_entries.items():
+            if lemmas is not None:
+                yield form, lemmas
+
+    def get(self, form):
+        if form in self.new_entries:
+            return self.new_entries[form] or []
+        return self.base.get(form)
+
+    def get_many(self, forms):
+        found = self.base.get_many(forms)
+        found.update(
+            {
+                form: self.new_entries[form] or []
+                for form in forms
+                if form in self.new_entries
+            }
+        )
+        return found
+
+    def forms(self, state=None):
+        return [
+            form for form in self.base.forms(state) if form not in self.new_entries
+        ] + [
+            form
+            for form, lemmas in self.new_entries.items()
+            if state in (None, entry_state(lemmas))
+        ]
+
+    def states(self):
+        states = self.base.states()
+        for lemmas in self.new_entries.values():
+            states[entry_state(lemmas)] += 1
+        return states
+
+    def update(self, entries):
+        self.new_entries.update(entries)
+
+    def close(self):
+        self.base.close()
+
+
+def export_json(cache, filename):
+    """
+    writes the answers in the given cache to a JSON cache file, keeping the
+    order of the entries already in it. Returns the number of entries.
+    """
+    json_cache = JSONCache(filename)
+    json_cache.update(dict(cache))
+    json_cache.close()
+    return len(json_cache)
+
+
+def open_cache(filename, read_only=False, error_ttl=ERROR_TTL):
+    """
+    opens the cache backend for the given filename: `.json` gets the original
+    whole-file cache, anything else an SQLite one (migrating from the JSON
+    cache of the same name if there is one).
+    """
+    root, ext = os.path.splitext(filename)
+    if ext == ".json":
+        return JSONCache(filename, read_only=read_only)
+    if read_only:
+        return SQLiteCache(filename, read_only=True, error_ttl=error_ttl)
+    return SQLiteCache(filename, migrate_from=root + ".json", error_ttl=error_ttl)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser(
+        "refresh", help="look up the cache's forms again"
+    )
+    refresh_parser.add_argument(
+        "--errors-only", action="store_true", help="only the forms whose lookup failed"
+    )
+    subparsers.add_parser(
+        "export", help="write the cache's answers to the committed JSON cache"
+    )
+    args = parser.parse_args()
+
+    lemmatise = load_script("lemmatise")
+    if args.command == "export":
+        json_filename = os.path.splitext(lemmatise.CACHE_FILENAME)[0] + ".json"
+        cache = open_cache(lemmatise.CACHE_FILENAME, read_only=True)
+        print(f"wrote {export_json(cache, json_filename)} items to {json_filename}.")
+        cache.close()
+    else:
+        with lemmatise.open_morpheus() as morpheus:
+            states = morpheus.refresh(
+                errors_only=args.errors_only, lang="grc", engine="morpheusgrc"
+            )
+            print(f"refreshed {sum(states.values())} forms: {format_states(states)}.")
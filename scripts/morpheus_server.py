@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+a local stand-in for the Perseids morphology service.
+
+Answers `GET ...?word=<form>` with the same RDF/Annotation/Body JSON shape as
+the real service, using a cache file (form -> list of lemmas) as its data.
+
+    ./scripts/morpheus_server.py cache/morpheus.json --port 8000
+    MORPHEUS_ENDPOINT=http://localhost:8000/ ./scripts/lemmatise.py
+
+(`lemmatise.py --offline` does the same without a server, in process.)
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from urllib.parse import parse_qs, urlparse
+
+from morpheus import make_response
+
+
+def make_handler(analyses):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # else headers and body wait on a delayed ACK
+
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            form = params.get("word", [""])[0]
+            content = json.dumps(make_response(form, analyses.get(form, []))).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(analyses, host="localhost", port=8000):
+    """
+    returns a (not yet started) server answering from the given analyses.
+    """
+    return ThreadingHTTPServer((host, port), make_handler(analyses))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("cache_filename")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    with open(args.cache_filename) as f:
+        analyses = json.load(f)
+
+    server = serve(analyses, args.host, args.port)
+    print(f"serving {len(analyses)} forms on http://{args.host}:{args.port}/")
+    server.serve_forever()
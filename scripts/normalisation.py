@@ -0,0 +1,148 @@
+"""
+token normalisation shared by the scripts, with results remembered.
+
+What has been worked out is kept in `cache/normalisation.sqlite` (for the
+installed `greek-normalisation` and the config below) so a later run only
+normalises tokens it hasn't seen before. Tokens are looked up there as they
+come, with the most recent `MEMO_SIZE` kept in memory, so memory doesn't grow
+with the vocabulary.
+"""
+
+import atexit
+from functools import lru_cache
+from importlib.metadata import version
+import os
+import sqlite3
+
+from profiling import PROFILE
+from utils import fingerprint
+
+from greek_normalisation.normalise import Normaliser, Norm
+
+
+CACHE_FILENAME = "cache/normalisation.sqlite"
+
+CONFIG = (
+    Norm.GRAVE
+    | Norm.ELISION
+    | Norm.MOVABLE
+    | Norm.EXTRA
+    | Norm.PROCLITIC
+    | Norm.ENCLITIC
+)
+
+PUNCTUATION = ",.;·«»()!"
+
+# in the order they appear in the `flags` row
+FLAG_LETTERS = [
+    (Norm.PROCLITIC, "p"),
+    (Norm.ENCLITIC, "n"),
+    (Norm.GRAVE, "g"),
+    (Norm.EXTRA, "x"),
+    (Norm.ELISION, "l"),
+    (Norm.MOVABLE, "m"),
+]
+
+MEMO_SIZE = 1 << 16
+
+
+def format_flags(flags):
+    s = "".join(letter for flag, letter in FLAG_LETTERS if flags & flag)
+    return s or "."
+
+
+# every combination of flags the normaliser can return, formatted up front
+FLAG_STRINGS = {
+    Norm(value): format_flags(Norm(value)) for value in range(Norm.ALL.value + 1)
+}
+
+
+class Normalisation:
+    """
+    the normalised form and flags of tokens, from the cache where known and
+    from the normaliser otherwise, new ones being saved when `MEMO_SIZE` have
+    built up and on exit.
+    """
+
+    def __init__(self, filename=CACHE_FILENAME, config=CONFIG):
+        self.filename = filename
+        self.normaliser = Normaliser(config)
+        self.key = fingerprint(
+            version("greek-normalisation"), config.value, PUNCTUATION
+        )
+        self.db = None  # opened when first needed
+        self.pid = None
+        self.new_norms = {}
+        self.normalise = lru_cache(maxsize=MEMO_SIZE)(self._normalise)
+        atexit.register(self.save)
+
+    def load(self):
+        """
+        opens the cache (again in a forked worker process, which can't share
+        its parent's connection), clearing it if it is for another normaliser.
+        """
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.db = sqlite3.connect(self.filename, timeout=60)
+        self.pid = os.getpid()
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT NOT NULL)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS norms"
+                " (word TEXT PRIMARY KEY, norm TEXT NOT NULL, flags TEXT NOT NULL)"
+            )
+            if self.db.execute("SELECT key FROM meta").fetchall() != [(self.key,)]:
+                self.db.execute("DELETE FROM meta")
+                self.db.execute("DELETE FROM norms")
+                self.db.execute("INSERT INTO meta (key) VALUES (?)", (self.key,))
+
+    def connection(self):
+        if self.db is None or self.pid != os.getpid():
+            self.load()
+        return self.db
+
+    def _normalise(self, token):
+        """
+        returns the normalised form and flags string of a token (with any
+        punctuation around it stripped).
+        """
+        word = token.strip(PUNCTUATION)
+        norm = self.new_norms.get(word)
+        if norm is None:
+            norm = self.connection().execute(
+                "SELECT norm, flags FROM norms WHERE word = ?", (word,)
+            ).fetchone()
+        if norm is None:
+            PROFILE.count("normalisation.misses")
+            norm_token, norm_flags = self.normaliser.normalise(word)
+            norm = self.new_norms[word] = (norm_token, FLAG_STRINGS[norm_flags])
+            if len(self.new_norms) >= MEMO_SIZE:
+                self.save()
+        return norm
+
+    def take_new(self):
+        """
+        returns (and forgets) the tokens normalised since last taken, for a
+        worker process to hand back to its parent.
+        """
+        new_norms, self.new_norms = self.new_norms, {}
+        return new_norms
+
+    def update(self, new_norms):
+        self.new_norms.update(new_norms)
+        if len(self.new_norms) >= MEMO_SIZE:
+            self.save()
+
+    def save(self):
+        if not self.new_norms:
+            return
+        with self.connection():
+            self.connection().executemany(
+                "INSERT OR REPLACE INTO norms (word, norm, flags) VALUES (?, ?, ?)",
+                ((word, norm, flags) for word, (norm, flags) in self.new_norms.items()),
+            )
+        self.new_norms = {}
+
+
+NORMALISATION = Normalisation()
+
+normalise = NORMALISATION.normalise
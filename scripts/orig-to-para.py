@@ -4,33 +4,88 @@
 converts the original files from Seumas into a textpart-per-paragraph format.
 """
 
+import argparse
 import unicodedata
 
+from chapters import chapters_argument, corpus_chapters, selected
+from profiling import PROFILE, profile_arguments, start_profile
+from utils import jobs_argument, map_chapters
+from validation import ValidationError, validator
 
-for chapter_num in range(1, 20):
+
+CHAPTERS = corpus_chapters()
+
+
+def paragraphs(chapter_num, lines):
+    """
+    yields the ref and text of each heading and paragraph in an original file.
+    """
+    chapter = None
+    section = None
+    for line in lines:
+        line = unicodedata.normalize("NFC", line.strip())
+        if line == "":  # blank line
+            pass
+        elif line.startswith("# "):
+            assert chapter is None
+            chapter = chapter_num
+            section = 0
+            paragraph = 0
+            yield f"{chapter:03d}.{section}.{paragraph:02d}", line.split(maxsplit=1)[1]
+        elif line.startswith("## "):
+            assert chapter is not None
+            section += 1
+            paragraph = 0
+            yield f"{chapter:03d}.{section}.{paragraph:02d}", line.split(maxsplit=1)[1]
+        else:
+            assert chapter is not None
+            assert section is not None
+            paragraph += 1
+            yield f"{chapter:03d}.{section}.{paragraph:02d}", line
+
+
+def check_paragraphs(paragraphs, filename):
+    """
+    checks the lines the given paragraphs are written as (in the given file)
+    against `config/text-validator-para.toml`.
+    """
+    check = validator("para").check
+    for line_num, (ref, text) in enumerate(paragraphs, 1):
+        check(f"{ref} {text}", filename, line_num)
+
+
+def process_chapter(chapter_num):
     input_filename = f"orig/{chapter_num:03d}.md"
     output_filename = f"text/lgpsi.para.{chapter_num:03d}.txt"
 
-    with open(input_filename) as f, open(output_filename, "w") as g:
-        chapter = None
-        section = None
-        for line in f:
-            line = unicodedata.normalize("NFC", line.strip())
-            if line == "":  # blank line
-                pass
-            elif line.startswith("# "):
-                assert chapter is None
-                chapter = chapter_num
-                section = 0
-                paragraph = 0
-                print(f"{chapter:03d}.{section}.{paragraph:02d}", line.split(maxsplit=1)[1], file=g)
-            elif line.startswith("## "):
-                assert chapter is not None
-                section += 1
-                paragraph = 0
-                print(f"{chapter:03d}.{section}.{paragraph:02d}", line.split(maxsplit=1)[1], file=g)
-            else:
-                assert chapter is not None
-                assert section is not None
-                paragraph += 1
-                print(f"{chapter:03d}.{section}.{paragraph:02d}", line, file=g)
+    with PROFILE.chapter(
+        "orig-to-para", chapter_num, [input_filename], [output_filename]
+    ) as record:
+        with open(input_filename) as f:
+            chapter_paragraphs = list(paragraphs(chapter_num, f))
+        check_paragraphs(
+            chapter_paragraphs, output_filename
+        )  # before writing, so nothing is half written
+        with open(output_filename, "w") as g:
+            for ref, text in chapter_paragraphs:
+                print(ref, text, file=g)
+                record["tokens"] += len(text.split())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    chapters_argument(parser)
+    jobs_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    try:
+        map_chapters(
+            "orig-to-para",
+            "process_chapter",
+            selected(CHAPTERS, args.chapters),
+            args.jobs,
+        )
+    except ValidationError as e:
+        raise SystemExit(f"invalid text: {e}")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""
+the lemma overrides in `manual-data/lemma_overrides.yaml`, compiled for lookup.
+
+Run as a script, reports which overrides fire for the `norm` files of the
+lemmatised chapters (or, with `--unused`, which never do).
+"""
+
+import argparse
+from collections import Counter
+
+from interlinear import analysis_filename, read_interlinear
+from profiling import PROFILE
+from utils import load_script
+
+import yaml
+
+
+FILENAME = "manual-data/lemma_overrides.yaml"
+
+
+class LemmaOverrides:
+    """
+    lemma overrides by norm: a `default` and/or lemmas for ref prefixes, the
+    longest matching prefix winning.
+
+    Each norm's prefixes are kept in a dict along with the distinct prefix
+    lengths (longest first) so a lookup is a handful of dict lookups rather
+    than a scan of every key. Keys that aren't strings are reported (and
+    ignored) once, when compiled.
+    """
+
+    def __init__(self, overrides):
+        self.defaults = {}
+        self.prefixes = {}
+        self.prefix_lengths = {}
+        self.errors = []
+        self.fired = Counter()
+
+        for norm, entry in (overrides or {}).items():
+            if not isinstance(entry, dict):
+                self.errors.append(f"*** {entry} is not a mapping (under {norm})")
+                continue
+            prefixes = {}
+            for k, v in entry.items():
+                if not isinstance(k, str):
+                    self.errors.append(f"*** {k} is not a string (under {norm})")
+                elif k == "default":
+                    self.defaults[norm] = v
+                else:
+                    prefixes[k] = v
+            if prefixes:
+                self.prefixes[norm] = prefixes
+                self.prefix_lengths[norm] = sorted(
+                    {len(k) for k in prefixes}, reverse=True
+                )
+
+        for error in self.errors:
+            print(error)
+
+    @classmethod
+    def load(cls, filename=FILENAME):
+        try:
+            with open(filename) as f:
+                return cls(yaml.safe_load(f))
+        except FileNotFoundError:
+            return cls({})
+
+    def __iter__(self):
+        """
+        yields (norm, key) for every override, key being `default` or a prefix.
+        """
+        for norm in self.defaults.keys() | self.prefixes.keys():
+            if norm in self.defaults:
+                yield norm, "default"
+            for prefix in self.prefixes.get(norm, {}):
+                yield norm, prefix
+
+    def resolve(self, norm, ref):
+        """
+        returns the lemma override for the given norm at the given ref (or None).
+        """
+        prefixes = self.prefixes.get(norm)
+        if prefixes is not None:
+            for length in self.prefix_lengths[norm]:
+                prefix = ref[:length]
+                if len(prefix) == length and prefix in prefixes:
+                    self.fired[(norm, prefix)] += 1
+                    PROFILE.count("overrides.hits")
+                    return prefixes[prefix]
+        if norm in self.defaults:
+            self.fired[(norm, "default")] += 1
+            PROFILE.count("overrides.hits")
+            return self.defaults[norm]
+        return None
+
+    def lemmas_by_norm(self):
+        """
+        returns the lemmas each norm can be overridden to.
+        """
+        lemmas = {}
+        for norm, key in self:
+            lemma = (
+                self.defaults[norm] if key == "default" else self.prefixes[norm][key]
+            )
+            lemmas.setdefault(norm, [])
+            if lemma not in lemmas[norm]:
+                lemmas[norm].append(lemma)
+        return lemmas
+
+    def unused(self):
+        return [override for override in self if override not in self.fired]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--unused", action="store_true", help="list the overrides that never fire"
+    )
+    args = parser.parse_args()
+
+    lemma_overrides = LemmaOverrides.load()
+    for chapter_num in load_script("lemmatise").CHAPTERS:
+        for sentence in read_interlinear(analysis_filename(chapter_num, "norm")):
+            for norm in sentence.norm:
+                lemma_overrides.resolve(norm, sentence.ref)
+
+    if args.unused:
+        for norm, key in sorted(lemma_overrides.unused()):
+            print(norm, key)
+    else:
+        for (norm, key), count in sorted(lemma_overrides.fired.items()):
+            print(norm, key, count)
@@ -4,23 +4,75 @@
 converts the textpart-per-paragraph to textpart-per-sentence.
 """
 
+import argparse
 
-for chapter_num in range(1, 20):
+from chapters import chapters_argument, corpus_chapters, selected
+from interlinear import Sentence, write_text
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+from utils import jobs_argument, map_chapters
+from validation import ValidationError, validator
+
+
+CHAPTERS = corpus_chapters()
+
+
+def sentences(paragraphs):
+    """
+    yields a sentence for each sentence in the given (ref, text) paragraphs.
+    """
+    for ref, text in paragraphs:
+        if ref.endswith(".00"):  # ignore headings
+            continue
+        sentence = []
+        sent_num = 1
+        for token in text.split():
+            sentence.append(token)
+            if "." in token or ";" in token or "·" in token or "!" in token:
+                yield Sentence(f"{ref}.{sent_num}", sentence)
+                sent_num += 1
+                sentence = []
+    assert sentence == [], f"finished para {ref} mid-sentence"
+
+
+def check_sentences(sentences, filename):
+    """
+    checks the lines the given sentences are written as (in the given file)
+    against `config/text-validator-sent.toml`.
+    """
+    check = validator("sent").check
+    for line_num, sentence in enumerate(sentences, 1):
+        check(f"{sentence.ref} {' '.join(sentence.text)}", filename, line_num)
+
+
+def process_chapter(chapter_num):
     input_filename = f"text/lgpsi.para.{chapter_num:03d}.txt"
     output_filename = f"text/lgpsi.sent.{chapter_num:03d}.txt"
 
-    with open(input_filename) as f, open(output_filename, "w") as g:
-        for line in f:
-            line = line.strip()
-            ref, text = line.split(maxsplit=1)
-            if ref.endswith(".00"):  # ignore headings
-                continue
-            sentence = []
-            sent_num = 1
-            for token in text.split():
-                sentence.append(token)
-                if "." in token or ";" in token or "·" in token or "!" in token:
-                    print(f"{ref}.{sent_num} {' '.join(sentence)}", file=g)
-                    sent_num += 1
-                    sentence = []
-        assert sentence == [], f"finished para {ref} mid-sentence"
+    with PROFILE.chapter(
+        "para-to-sent", chapter_num, [input_filename], [output_filename]
+    ) as record:
+        with open(input_filename) as f:
+            paragraphs = [line.strip().split(maxsplit=1) for line in f]
+        chapter_sentences = list(sentences(paragraphs))
+        check_sentences(chapter_sentences, output_filename)
+        write_text(chapter_sentences, output_filename)
+        record["tokens"] += count_tokens(chapter_sentences)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    chapters_argument(parser)
+    jobs_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+
+    try:
+        map_chapters(
+            "para-to-sent",
+            "process_chapter",
+            selected(CHAPTERS, args.chapters),
+            args.jobs,
+        )
+    except ValidationError as e:
+        raise SystemExit(f"invalid text: {e}")
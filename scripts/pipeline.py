@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+"""
+rebuilds whatever is out of date in the chain from `orig` through to `docs`.
+
+    orig -> para -> sent -> norm -> lemma -> exposures -> json -> docs
+                                                       -> concordance -> docs
+
+Outputs are fingerprinted by their input and code in `cache/pipeline.json` and
+only rebuilt when that changes. The cumulative stages resume from the snapshot
+before the first stale chapter (see `checkpoints.py`).
+"""
+
+import argparse
+from collections import defaultdict
+import json
+import os
+
+from chapter_data import Cumulative, FullView, write_delta
+from chapters import catching_up, chapters_argument, format_chapters, selected
+from concordance import Concordance, ConcordanceBuilder
+from exposure_engine import Exposures
+from interlinear import (
+    ANALYSIS_EXTENSION,
+    analysis_filename,
+    read_interlinear,
+    write_interlinear,
+    write_text,
+)
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+from utils import file_hash, fingerprint, jobs_argument, load_script, map_chapters
+from validation import ValidationError
+
+
+STATE_FILENAME = "cache/pipeline.json"
+
+
+class Stage:
+    """
+    a stage that maps each chapter's input file to an output file by calling
+    `function(chapter_num)` in `script`. If `lists_chapters`, every output
+    also depends on which chapters there are and on whether the pages share
+    their assets (as the pages' navigation does).
+    """
+
+    def __init__(
+        self,
+        name,
+        script,
+        input_pattern,
+        output_pattern,
+        depends=(),
+        function="process_chapter",
+        lists_chapters=False,
+    ):
+        self.name = name
+        self.script = script
+        self.input_pattern = input_pattern
+        self.output_pattern = output_pattern
+        self.depends = [
+            "scripts/utils.py",
+            "scripts/interlinear.py",
+            f"scripts/{script}.py",
+            *depends,
+        ]
+        self.function = function
+        self.lists_chapters = lists_chapters
+
+    @property
+    def module(self):
+        return load_script(self.script)
+
+    def code_hash(self):
+        hashes = [file_hash(filename) for filename in self.depends]
+        if self.lists_chapters:
+            hashes.append(format_chapters(self.module.CHAPTERS))
+            hashes.append(load_script("render").SHARED_ASSETS)
+        return fingerprint(*hashes)
+
+    def key(self, chapter_num, code_hash):
+        return fingerprint(code_hash, file_hash(self.input_pattern.format(chapter_num)))
+
+    def is_fresh(self, record, key, chapter_num):
+        return (
+            record is not None
+            and record["key"] == key
+            and record["output"] == file_hash(self.output_pattern.format(chapter_num))
+        )
+
+    def stale(self, stale_chapters, only):
+        return stale_chapters
+
+    def run(self, chapters, jobs, only):
+        """
+        rebuilds the given chapters, returning those rebuilt.
+        """
+        map_chapters(self.script, self.function, chapters, jobs)
+        return chapters
+
+    def build(self, state, force=False, jobs=1, only=None):
+        records = state.setdefault(self.name, {})
+        code_hash = self.code_hash()
+        chapters = selected(self.module.CHAPTERS, only)
+        keys = {
+            chapter_num: self.key(chapter_num, code_hash) for chapter_num in chapters
+        }
+
+        stale_chapters = self.stale(
+            [
+                chapter_num
+                for chapter_num in chapters
+                if force
+                or not self.is_fresh(
+                    records.get(str(chapter_num)), keys[chapter_num], chapter_num
+                )
+            ],
+            only,
+        )
+
+        if stale_chapters:
+            print(f"{self.name}: {format_chapters(stale_chapters)}")
+            written = self.run(stale_chapters, jobs, only)
+            following = sorted(set(written) - set(stale_chapters))
+            if following:
+                print(
+                    f"{self.name}: {format_chapters(following)}"
+                    " (following on from those)"
+                )
+            for chapter_num in written:
+                records.setdefault(str(chapter_num), {}).update({
+                    "key": keys[chapter_num],
+                    "output": file_hash(self.output_pattern.format(chapter_num)),
+                })
+
+        return stale_chapters
+
+
+class NormStage(Stage):
+
+    def run(self, chapters, jobs, only):
+        for new_norms in map_chapters(self.script, self.function, chapters, jobs):
+            self.module.NORMALISATION.update(new_norms)
+        return chapters
+
+
+class LemmaStage(Stage):
+
+    morpheus = None  # kept open between builds by `watch.py`
+
+    def run(self, chapters, jobs, only):
+        problems = defaultdict(list)
+        if self.morpheus is not None:
+            self.module.process_chapters(chapters, self.morpheus, problems, jobs)
+        else:
+            with self.module.open_morpheus() as morpheus:
+                self.module.process_chapters(chapters, morpheus, problems, jobs)
+        self.module.print_problems(problems)
+        return chapters
+
+
+class CheckpointedStage(Stage):
+    """
+    a stage whose output for a chapter depends on all the chapters before it,
+    whose script's `process_chapters` rewrites the stale chapters and as many
+    after them as have changed as a result.
+    """
+
+    def run(self, chapters, jobs, only):
+        return self.module.process_chapters(only=only, rewrite=chapters)
+
+
+class CumulativeStage(Stage):
+    """
+    a stage whose output for a chapter depends on all the chapters before it,
+    so everything from the first stale chapter onward must be rebuilt,
+    starting from `new_state(module, chapter_num)` (the state before it).
+    """
+
+    def __init__(self, *args, new_state, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.new_state = new_state
+
+    def stale(self, stale_chapters, only):
+        if not stale_chapters:
+            return []
+        return [
+            chapter_num for chapter_num in selected(self.module.CHAPTERS, only)
+            if chapter_num >= min(stale_chapters)
+        ]
+
+    def run(self, chapters, jobs, only):
+        state = self.new_state(self.module, chapters[0])
+        process = getattr(self.module, self.function)
+        later = [
+            chapter_num
+            for chapter_num in self.module.CHAPTERS
+            if chapter_num >= chapters[0]
+        ]
+        for chapter_num, write in catching_up(later, chapters):
+            process(chapter_num, *state, write=write)
+        return chapters
+
+
+class ConcordanceStage(Stage):
+    """
+    builds the concordance from every chapter's exposures and renders the
+    indexes from it, all as one output keyed on all of the chapters (whichever
+    are being built).
+    """
+
+    OUTPUT_FILENAMES = [
+        "cache/concordance.idx",
+        "docs/lgpsi_ref_index.html",
+        "docs/lgpsi_lemma_index.html",
+        "docs/lgpsi_search.html",
+    ]
+
+    def build(self, state, force=False, jobs=1, only=None):
+        code_hash = self.code_hash()
+        key = fingerprint(
+            *(self.key(chapter_num, code_hash) for chapter_num in self.module.CHAPTERS)
+        )
+        record = state.get(self.name)
+        if (
+            force
+            or record is None
+            or record["key"] != key
+            or record["outputs"]
+            != [file_hash(filename) for filename in self.OUTPUT_FILENAMES]
+        ):
+            print(f"{self.name}: {format_chapters(self.module.CHAPTERS)}")
+            self.module.build(self.module.CHAPTERS)
+            with self.module.Concordance() as concordance:
+                load_script("render").render_indexes(concordance)
+            state[self.name] = {
+                "key": key,
+                "outputs": [file_hash(filename) for filename in self.OUTPUT_FILENAMES],
+            }
+            return list(self.module.CHAPTERS)
+        return []
+
+
+def analysis_pattern(name):
+    return "analysis/lgpsi.sent.{:03d}." + name + ANALYSIS_EXTENSION
+
+
+STAGES = [
+    Stage(
+        "para",
+        "orig-to-para",
+        "orig/{:03d}.md",
+        "text/lgpsi.para.{:03d}.txt",
+        depends=["scripts/validation.py", "config/text-validator-para.toml"],
+    ),
+    Stage(
+        "sent",
+        "para-to-sent",
+        "text/lgpsi.para.{:03d}.txt",
+        "text/lgpsi.sent.{:03d}.txt",
+        depends=["scripts/validation.py", "config/text-validator-sent.toml"],
+    ),
+    NormStage(
+        "norm",
+        "add-norm",
+        "text/lgpsi.sent.{:03d}.txt",
+        analysis_pattern("norm"),
+        depends=["scripts/normalisation.py"],
+    ),
+    LemmaStage(
+        "lemma",
+        "lemmatise",
+        analysis_pattern("norm"),
+        analysis_pattern("lemma"),
+        depends=[
+            "scripts/morpheus.py",
+            "scripts/overrides.py",
+            "manual-data/lemma_overrides.yaml",
+        ],
+    ),
+    CheckpointedStage(
+        "exposures",
+        "add_exposures",
+        analysis_pattern("lemma"),
+        analysis_pattern("exposures"),
+        depends=["scripts/exposure_engine.py", "scripts/checkpoints.py"],
+    ),
+    CheckpointedStage(
+        "chapter-data",
+        "generate-chapter-data",
+        analysis_pattern("lemma"),
+        "analysis/lgpsi.{:03d}.json",
+        depends=[
+            "scripts/chapter_data.py",
+            "scripts/exposure_engine.py",
+            "scripts/collation.py",
+            "scripts/checkpoints.py",
+        ],
+    ),
+    Stage(
+        "pages",
+        "render",
+        analysis_pattern("exposures"),
+        "docs/lgpsi_{:03d}.html",
+        depends=["scripts/concordance.py", "scripts/collation.py"],
+        function="render_chapter",
+        lists_chapters=True,
+    ),
+    ConcordanceStage(
+        "concordance",
+        "concordance",
+        analysis_pattern("exposures"),
+        None,
+        depends=["scripts/render.py", "scripts/collation.py"],
+        lists_chapters=True,
+    ),
+    CumulativeStage(
+        "reports",
+        "render",
+        "analysis/lgpsi.{:03d}.json",
+        "docs/lgpsi_{:03d}_report.html",
+        depends=["scripts/chapter_data.py", "scripts/collation.py"],
+        function="process_report",
+        lists_chapters=True,
+        new_state=lambda module, chapter_num: (
+            Cumulative.before(chapter_num, module.CHAPTERS),
+        ),
+    ),
+]
+
+
+def load_state():
+    if os.path.exists(STATE_FILENAME):
+        with open(STATE_FILENAME) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state):
+    with open(STATE_FILENAME + ".tmp", "w") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(STATE_FILENAME + ".tmp", STATE_FILENAME)
+
+
+def build(force=False, jobs=1, only=None):
+    state = load_state()
+    for stage in STAGES:
+        stage.build(state, force, jobs, only)
+        save_state(state)  # after each stage so an interrupted run keeps its progress
+
+    render = load_script("render")
+    render.compress_docs()
+
+
+def build_in_memory(interlinear=False):
+    """
+    runs every stage over each chapter in turn in this one process, keeping
+    each chapter's sentences in memory rather than round-tripping them
+    through the files in `text` and `analysis`. Only the chapter data, the
+    concordance and `docs` are written unless `interlinear` is true.
+
+    Chapters not covered by lemmatisation carry on from their existing lemma
+    file (as the file-based stages do).
+    """
+    orig_to_para = load_script("orig-to-para")
+    para_to_sent = load_script("para-to-sent")
+    add_norm = load_script("add-norm")
+    lemmatise = load_script("lemmatise")
+    add_exposures = load_script("add_exposures")
+    generate_chapter_data = load_script("generate-chapter-data")
+    render = load_script("render")
+
+    exposures = Exposures()
+    cumulative = Cumulative()
+    concordance = ConcordanceBuilder()
+    problems = defaultdict(list)
+
+    lemmatised_chapters = set(lemmatise.CHAPTERS)
+
+    with lemmatise.open_morpheus() as morpheus:
+        for chapter_num in orig_to_para.CHAPTERS:
+            with PROFILE.chapter(
+                "orig-to-para", chapter_num, [f"orig/{chapter_num:03d}.md"]
+            ) as record:
+                with open(f"orig/{chapter_num:03d}.md") as f:
+                    paragraphs = list(orig_to_para.paragraphs(chapter_num, f))
+                orig_to_para.check_paragraphs(
+                    paragraphs, f"text/lgpsi.para.{chapter_num:03d}.txt"
+                )
+                record["tokens"] += sum(len(text.split()) for _, text in paragraphs)
+            with PROFILE.chapter("para-to-sent", chapter_num) as record:
+                sentences = list(para_to_sent.sentences(paragraphs))
+                para_to_sent.check_sentences(
+                    sentences, f"text/lgpsi.sent.{chapter_num:03d}.txt"
+                )
+                record["tokens"] += count_tokens(sentences)
+
+            with PROFILE.chapter("add-norm", chapter_num) as record:
+                for sentence in sentences:
+                    add_norm.normalise_sentence(sentence)
+                record["tokens"] += count_tokens(sentences)
+
+            lemma_filename = analysis_filename(chapter_num, "lemma")
+            if chapter_num in lemmatised_chapters:
+                with PROFILE.chapter("lemmatise", chapter_num) as record:
+                    lemmatise.lemmatise(sentences, morpheus, problems)
+                    record["tokens"] += count_tokens(sentences)
+                lemmatised = sentences
+            else:
+                lemmatised = read_interlinear(lemma_filename)
+
+            with PROFILE.chapter("add_exposures", chapter_num) as record:
+                add_exposures.add_exposures(lemmatised, exposures)
+                record["tokens"] += count_tokens(lemmatised)
+            with PROFILE.chapter("generate-chapter-data", chapter_num) as record:
+                delta = generate_chapter_data.chapter_delta(lemmatised, cumulative)
+                write_delta(chapter_num, delta)
+                record["tokens"] += count_tokens(lemmatised)
+
+            render.render_chapter(chapter_num, lemmatised)
+            with PROFILE.chapter("report", chapter_num) as record:
+                render.render_report(
+                    chapter_num, FullView(chapter_num, delta, cumulative)
+                )
+                record["tokens"] += count_tokens(lemmatised)
+            cumulative.add(chapter_num, delta)
+            with PROFILE.chapter("concordance", chapter_num) as record:
+                concordance.add(lemmatised)
+                record["tokens"] += count_tokens(lemmatised)
+
+            if interlinear:
+                with open(f"text/lgpsi.para.{chapter_num:03d}.txt", "w") as g:
+                    for ref, text in paragraphs:
+                        print(ref, text, file=g)
+                write_text(sentences, f"text/lgpsi.sent.{chapter_num:03d}.txt")
+                write_interlinear(
+                    sentences,
+                    ["text", "flags", "norm"],
+                    analysis_filename(chapter_num, "norm"),
+                )
+                if chapter_num in lemmatised_chapters:
+                    write_interlinear(
+                        sentences, ["text", "norm", "flags", "lemma"], lemma_filename
+                    )
+                write_interlinear(
+                    lemmatised,
+                    ["text", "norm", "flags", "lemma", "normexp", "lemmaexp"],
+                    analysis_filename(chapter_num, "exposures"),
+                )
+
+    concordance.write()
+    with Concordance() as index:
+        render.render_indexes(index)
+    lemmatise.print_problems(problems)
+    render.compress_docs()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--force", action="store_true", help="rebuild everything")
+    parser.add_argument(
+        "--in-memory", action="store_true",
+        help="rebuild everything in one pass without going via the intermediate files",
+    )
+    parser.add_argument(
+        "--interlinear", action="store_true",
+        help="with --in-memory, also write the intermediate files in text and analysis",
+    )
+    chapters_argument(parser)
+    jobs_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+    if args.in_memory and args.chapters:
+        parser.error("--chapters can't be used with --in-memory")
+
+    try:
+        if args.in_memory:
+            build_in_memory(interlinear=args.interlinear)
+        else:
+            build(force=args.force, jobs=args.jobs, only=args.chapters)
+    except ValidationError as e:
+        raise SystemExit(f"invalid text: {e}")
@@ -0,0 +1,220 @@
+"""
+optional instrumentation: per-stage, per-chapter timings and counters written
+as JSON (and optionally a cProfile dump) when a script exits.
+
+Turned on by `--profile FILE` (and `--cprofile FILE`) on the scripts or by
+setting `LGPSI_PROFILE` (and `LGPSI_CPROFILE`) to the filename. When off, the
+hooks cost next to nothing.
+"""
+
+import atexit
+import cProfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+
+
+PROFILE_ENV = "LGPSI_PROFILE"
+CPROFILE_ENV = "LGPSI_CPROFILE"
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kilobytes on Linux
+
+
+def file_size(filename):
+    return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+
+def count_tokens(sentences):
+    return sum(len(sentence.text) for sentence in sentences)
+
+
+class Profile:
+    """
+    what has been recorded in this process: a record per chapter of each
+    stage, plus counters, histograms and section timings for the whole run
+    (those made during a chapter are also kept on its record).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.worker = False
+        self.filename = None
+        self.cprofile = None
+        self.cprofile_filename = None
+        self.start_time = None
+        self.current = None
+        self.lock = threading.Lock()  # histograms are added to from fetching threads
+        self.reset()
+
+    def reset(self):
+        self.chapters = []
+        self.counters = Counter()
+        self.histograms = defaultdict(Counter)
+        self.sections = Counter()
+
+    def start(self, filename, cprofile_filename=None):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.filename = filename
+        self.start_time = time.perf_counter()
+        os.environ[PROFILE_ENV] = filename  # so worker processes record too
+        if cprofile_filename:
+            self.cprofile_filename = cprofile_filename
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        atexit.register(self.write)
+
+    @contextmanager
+    def chapter(self, stage, chapter_num, inputs=(), outputs=()):
+        """
+        records the wall time, bytes read and written (the sizes of the given
+        files), peak memory and anything counted during a chapter of a stage.
+        Tokens processed are added to the yielded record's `tokens`.
+        """
+        record = {"stage": stage, "chapter": chapter_num, "tokens": 0}
+        if not self.enabled:
+            yield record
+            return
+        record.update(counters=Counter(), sections=Counter())
+        previous, self.current = self.current, record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["bytes_read"] = sum(map(file_size, inputs))
+            record["bytes_written"] = sum(map(file_size, outputs))
+            record["peak_rss_kb"] = peak_rss()
+            self.current = previous
+            self.chapters.append(record)
+
+    @contextmanager
+    def section(self, name):
+        """
+        accumulates the time spent in a named part of the work.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.sections[name] += elapsed
+            if self.current is not None:
+                self.current["sections"][name] += elapsed
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+            if self.current is not None:
+                self.current["counters"][name] += n
+
+    def observe(self, name, value):
+        """
+        adds a (positive) value to a histogram of powers-of-two buckets.
+        """
+        if self.enabled:
+            bucket = max(0, math.ceil(math.log2(value))) if value > 0 else 0
+            with self.lock:
+                self.histograms[name][bucket] += 1
+
+    def take(self):
+        """
+        returns (and clears) what has been recorded, for a worker process to
+        hand back to its parent.
+        """
+        self.worker = True
+        recorded = (self.chapters, self.counters, dict(self.histograms), self.sections)
+        self.reset()
+        return recorded
+
+    def merge(self, recorded):
+        chapters, counters, histograms, sections = recorded
+        self.chapters.extend(chapters)
+        self.counters.update(counters)
+        for name, histogram in histograms.items():
+            self.histograms[name].update(histogram)
+        self.sections.update(sections)
+
+    def report(self):
+        stages = {}
+        for record in self.chapters:
+            stage = stages.setdefault(
+                record["stage"],
+                {
+                    "seconds": 0,
+                    "tokens": 0,
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                    "chapters": {},
+                },
+            )
+            for key in ["seconds", "tokens", "bytes_read", "bytes_written"]:
+                stage[key] += record[key]
+            stage["chapters"][record["chapter"]] = {
+                key: value
+                for key, value in record.items()
+                if key not in {"stage", "chapter"}
+            }
+        for stage in stages.values():
+            stage["tokens_per_second"] = (
+                round(stage["tokens"] / stage["seconds"]) if stage["seconds"] else None
+            )
+
+        return {
+            "argv": sys.argv,
+            "seconds": time.perf_counter() - self.start_time,
+            "peak_rss_kb": peak_rss(),
+            "stages": stages,
+            "sections": self.sections,
+            "counters": self.counters,
+            "histograms": {
+                name: {
+                    f"<={2 ** bucket}": count
+                    for bucket, count in sorted(histogram.items())
+                }
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+    def write(self):
+        if self.worker:
+            return
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_filename)
+        with open(self.filename, "w") as g:
+            json.dump(self.report(), g, ensure_ascii=False, indent=2)
+
+
+PROFILE = Profile()
+
+if os.environ.get(PROFILE_ENV):
+    PROFILE.start(os.environ[PROFILE_ENV], os.environ.get(CPROFILE_ENV))
+
+
+def profile_arguments(parser):
+    parser.add_argument(
+        "--profile", metavar="FILE", help="write timings and counters as JSON to FILE"
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FILE",
+        help="with --profile, also write a cProfile dump to FILE",
+    )
+
+
+def start_profile(args):
+    if args.profile:
+        PROFILE.start(args.profile, args.cprofile)
@@ -1,17 +1,84 @@
 #!/usr/bin/env python3
 
+import argparse
 from collections import defaultdict
-
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import gzip
+import hashlib
 import json
-
-from pyuca import Collator
-coll = Collator()
-
-
-HEADER = """\
-<head>
-  <meta charset="utf-8">
-  <style>
+import os
+from unicodedata import combining, normalize
+
+try:
+    import brotli
+except ImportError:  # only needed for `.br` siblings
+    brotli = None
+
+from chapter_data import Cumulative, FullView, delta_filename, read_delta
+from chapters import (
+    catching_up,
+    chapters_argument,
+    corpus_chapters,
+    format_chapters,
+    selected,
+)
+from collation import collation_key
+from concordance import (
+    FILENAME as CONCORDANCE_FILENAME,
+    Concordance,
+    build as build_concordance,
+    is_stale as concordance_is_stale,
+)
+from interlinear import analysis_filename, read_interlinear
+from profiling import PROFILE, count_tokens, profile_arguments, start_profile
+from utils import file_hash, fingerprint
+
+
+CHAPTERS = corpus_chapters()
+
+STATE_FILENAME = "cache/render.json"
+
+# the code a page depends on, besides its inputs
+CODE_FILENAMES = [
+    "scripts/render.py", "scripts/chapter_data.py", "scripts/collation.py",
+    "scripts/concordance.py", "scripts/interlinear.py", "scripts/utils.py",
+]
+
+INDEX_FILENAMES = [
+    "docs/lgpsi_ref_index.html",
+    "docs/lgpsi_lemma_index.html",
+    "docs/lgpsi_search.html",
+]
+
+SEARCH_DIRECTORY = "docs/search"
+
+# the most search keys a shard of the search index has before it is split by
+# the next letter
+SHARD_KEYS = 256
+
+BUFFER_SIZE = 1 << 16
+
+ASSETS_ENV = "LGPSI_ASSETS"
+COMPRESS_ENV = "LGPSI_COMPRESS"
+
+ASSETS_DIRECTORY = "docs/assets"
+
+# whether pages link to the CSS and navigation as shared files (named for a
+# hash of their content, so they can be cached indefinitely) rather than
+# each including them
+SHARED_ASSETS = os.environ.get(ASSETS_ENV) == "shared"
+
+# the precompressed siblings (`gz` and/or `br`) written for the files in `docs`
+COMPRESSION = [
+    extension for extension in os.environ.get(COMPRESS_ENV, "").split(",") if extension
+]
+
+COMPRESSED_EXTENSIONS = (".html", ".css", ".js", ".json")
+
+COMPRESSION_EXTENSIONS = ("gz", "br")
+
+STYLE = """\
     body {
       font-size: 14pt;
       line-height: 1.6;
@@ -58,121 +125,410 @@ HEADER = """\
     table td {
       padding: 2px 10px;
     }
-  </style>
-</head>
-<nav>
 """
 
-HEADER += f'<div>'
-
-for chapter_num in range(1, 20):
-    HEADER += f'<a href="lgpsi_{chapter_num:03d}.html">{chapter_num:03d}</a>\n'
+NAV = "<div>"
 
-HEADER += f'</div><div>'
+for chapter_num in CHAPTERS:
+    NAV += f'<a href="lgpsi_{chapter_num:03d}.html">{chapter_num:03d}</a>\n'
 
-for chapter_num in range(1, 20):
-    HEADER += f'<a href="lgpsi_{chapter_num:03d}_report.html">{chapter_num:03d}_report</a>\n'
+NAV += "</div><div>"
 
-HEADER += f'</div><div><a href="lgpsi_lemma_index.html">alphabetical index</a>\n'
-HEADER += f'| <a href="lgpsi_ref_index.html">index by ref</a></div>\n'
-HEADER += f'</nav>\n'
+for chapter_num in CHAPTERS:
+    NAV += (
+        f'<a href="lgpsi_{chapter_num:03d}_report.html">{chapter_num:03d}_report</a>\n'
+    )
 
+# the links to the indexes, which are all the navigation a page linking to
+# the shared assets has without JavaScript
+INDEX_NAV = '<div><a href="lgpsi_lemma_index.html">alphabetical index</a>\n'
+INDEX_NAV += '| <a href="lgpsi_ref_index.html">index by ref</a>\n'
+INDEX_NAV += '| <a href="lgpsi_search.html">search</a></div>\n'
 
+NAV += "</div>" + INDEX_NAV
 
-index_by_ref = defaultdict(list)
-
-for chapter_num in range(1, 20):
-    input_filename = f"analysis/lgpsi.sent.{chapter_num:03d}.exposures.txt"
-    output_filename = f"docs/lgpsi_{chapter_num:03d}.html"
-
-    with open(input_filename) as f, open(output_filename, "w") as g:
-
-        prev_para_ref = None
-        text = []
+HEADER = f"""\
+<head>
+  <meta charset="utf-8">
+  <style>
+{STYLE}  </style>
+</head>
+<nav>
+{NAV}</nav>
+"""
 
-        print(HEADER, file=g)
+NAV_SCRIPT = 'document.querySelector("nav").innerHTML = {};\n'
+
+# the search page's lookups: a lemma or form query fetches the shard whose
+# prefix is the longest that its search key starts with (listed in `SHARDS`),
+# a ref query the shard of the ref's chapter
+SEARCH_SCRIPT = r"""
+const MAX_RESULTS = 100;
+const MAX_REFS = 20;
+const input = document.getElementById("query");
+const results = document.getElementById("results");
+const shards = {};
+
+function searchKey(s) {
+  return s.normalize("NFD").replace(/\p{M}/gu, "").toLowerCase().replace(/ς/g, "σ");
+}
+
+function fetchShard(filename) {
+  if (!(filename in shards)) {
+    shards[filename] = fetch(`search/${filename}.json`)
+      .then(response => response.ok ? response.json() : null);
+  }
+  return shards[filename];
+}
+
+function refLink(ref) {
+  const chapter = ref.split(".")[0];
+  return `<a href="lgpsi_${chapter}.html"><span class="ref">${ref}</span></a>`;
+}
+
+async function searchRefs(query) {
+  const chapter = query.split(".")[0].padStart(3, "0");
+  const refs = await fetchShard(`ref-${chapter}`) || {};
+  query = [chapter, ...query.split(".").slice(1)].join(".");
+  return Object.entries(refs)
+    .filter(([ref]) => ref.startsWith(query))
+    .map(([ref, lemmas]) => `<div>${refLink(ref)} ${lemmas.join(" ")}</div>`);
+}
+
+async function searchWords(query) {
+  const key = searchKey(query);
+  // first, so it shows even with no shard for the query yet (or too many matches)
+  const longer = Object.keys(SHARDS)
+    .some(other => other.length > key.length && other.startsWith(key));
+  const lines = longer ? ["<p>Type more letters for further matches.</p>"] : [];
+  const prefixes = Object.keys(SHARDS).filter(prefix => key.startsWith(prefix));
+  if (!prefixes.length) {
+    return lines;
+  }
+  const prefix = prefixes.reduce((a, b) => b.length > a.length ? b : a);
+  const shard = await fetchShard(SHARDS[prefix]) || {lemmas: {}, forms: {}};
+  for (const [lemma, data] of Object.entries(shard.lemmas)) {
+    if (searchKey(lemma).startsWith(key)) {
+      const forms = Object.entries(data.forms)
+        .map(([form, count]) => `${form} (${count})`).join(", ");
+      const first = refLink(data.first);
+      lines.push(`<div><b>${lemma}</b> first seen ${first}: ${forms}</div>`);
+    }
+  }
+  for (const [form, lemmas] of Object.entries(shard.forms)) {
+    if (searchKey(form).startsWith(key)) {
+      for (const [lemma, refs] of Object.entries(lemmas)) {
+        const more = refs.length > MAX_REFS ? ` … (${refs.length})` : "";
+        const links = refs.slice(0, MAX_REFS).map(refLink).join(" ");
+        lines.push(`<div>${form} <i>${lemma}</i> ${links}${more}</div>`);
+      }
+    }
+  }
+  return lines;
+}
+
+input.addEventListener("input", async () => {
+  const query = input.value.trim();
+  const lines = !query ? []
+    : /^\d/.test(query) ? await searchRefs(query) : await searchWords(query);
+  if (input.value.trim() === query) {
+    results.innerHTML = lines.slice(0, MAX_RESULTS).join("\n");
+  }
+});
+"""
 
-        for line in f:
 
-            if ".text " in line:
-                text_list = line.strip().split()
+def write_asset(name, extension, content):
+    """
+    writes a shared asset (unless it already exists) named for a hash of its
+    content, returning its filename.
+    """
+    data = content.encode("utf-8")
+    filename = f"{name}.{hashlib.sha256(data).hexdigest()[:12]}.{extension}"
+    path = os.path.join(ASSETS_DIRECTORY, filename)
+    if not os.path.exists(path):
+        os.makedirs(ASSETS_DIRECTORY, exist_ok=True)
+        with open(path, "wb") as g:
+            g.write(data)
+    return filename
+
+
+@lru_cache(maxsize=None)
+def header():
+    """
+    the start of every page: `HEADER` or, with `SHARED_ASSETS`, links to the
+    CSS and to a script filling in the navigation (with just the links to
+    the indexes until it runs).
+    """
+    if not SHARED_ASSETS:
+        return HEADER
+    style = write_asset("lgpsi", "css", STYLE)
+    nav = write_asset(
+        "nav", "js", NAV_SCRIPT.format(json.dumps(NAV, ensure_ascii=False))
+    )
+    return f"""\
+<head>
+  <meta charset="utf-8">
+  <link rel="stylesheet" href="assets/{style}">
+  <script src="assets/{nav}" defer></script>
+</head>
+<nav>
+{INDEX_NAV}</nav>
+"""
 
-            if ".norm " in line:
-                norm_list = line.strip().split()
 
-            if ".flags " in line:
-                flags_list = line.strip().split()
+def write_page(filename, lines):
+    """
+    writes the lines of a page as they are generated, through one buffered
+    file rather than a write per line.
+    """
+    with open(filename, "w", buffering=BUFFER_SIZE) as g:
+        g.writelines(f"{line}\n" for line in lines)
 
-            if ".lemma " in line:
-                lemma_list = line.strip().split()
 
-            if ".normexp " in line:
-                normexp_list = line.strip().split()
+def render_chapter(chapter_num, sentences=None):
+    """
+    renders the text of the given chapter (from its exposures file unless the
+    sentences are given).
+    """
+    input_filename = analysis_filename(chapter_num, "exposures")
+    output_filename = f"docs/lgpsi_{chapter_num:03d}.html"
 
-            if ".lemmaexp " in line:
-                lemmaexp_list = line.strip().split()
+    with PROFILE.chapter(
+        "render", chapter_num, [input_filename], [output_filename]
+    ) as record:
+        if sentences is None:
+            sentences = read_interlinear(input_filename)
+        record["tokens"] += count_tokens(sentences)
+        write_page(output_filename, chapter_lines(sentences))
 
-                para_ref = ".".join(line.split(".lemmaexp")[0].split(".")[:3])
 
-                if para_ref != prev_para_ref:
-                    if text:
-                        print(" ".join(text), file=g)
-                        text = []
-                    print(f'<p><span class="ref">{para_ref}</span>', file=g)
-                    prev_para_ref = para_ref
+def chapter_lines(sentences):
 
-                for token, lemma, normexp, lemmaexp in zip(text_list[1:], lemma_list[1:], normexp_list[1:], lemmaexp_list[1:]):
-                    if lemmaexp == "1":
-                        text.append(f'<span class="new-lemma">{token}</span>')
-                        index_by_ref[para_ref].append(lemma)
-                    elif normexp == "1":
-                        text.append(f'<span class="new-form">{token}</span>')
-                    else:
-                        text.append(f'{token}')
+    prev_para_ref = None
+    text = []
 
-        print(" ".join(text), file=g)
+    yield header()
 
+    for sentence in sentences:
 
+        para_ref = ".".join(sentence.ref.split(".")[:3])
 
+        if para_ref != prev_para_ref:
+            if text:
+                yield " ".join(text)
+                text = []
+            yield f'<p><span class="ref">{para_ref}</span>'
+            prev_para_ref = para_ref
 
-index_by_lemma = {}
+        for token, normexp, lemmaexp in zip(
+            sentence.text, sentence.normexp, sentence.lemmaexp
+        ):
+            if lemmaexp == 1:
+                text.append(f'<span class="new-lemma">{token}</span>')
+            elif normexp == 1:
+                text.append(f'<span class="new-form">{token}</span>')
+            else:
+                text.append(f'{token}')
 
+    yield " ".join(text)
 
-output_filename = f"docs/lgpsi_ref_index.html"
 
-with open(output_filename, "w") as g:
+def render_indexes(concordance):
+    """
+    renders the indexes of new lemma exposures from the first occurrence of
+    each lemma in the given `concordance.Concordance`.
+    """
 
-    print(HEADER, file=g)
+    index_by_ref = defaultdict(list)
+    first_exposures = concordance.first_exposures()
+    for lemma in sorted(first_exposures, key=first_exposures.get):
+        ref, _ = concordance.sentence(first_exposures[lemma][0])
+        index_by_ref[".".join(ref.split(".")[:3])].append(lemma)
 
-    print("<h1>New Lemma Exposures by Ref</h1>", file=g)
+    index_by_lemma = {}
     for ref, lemma_list in index_by_ref.items():
-      print(f'<div><span class="ref">{ref}</span> {" ".join(lemma_list)}</div>', file=g)
-      for lemma in lemma_list:
-        index_by_lemma[lemma] = ref
-
-output_filename = f"docs/lgpsi_lemma_index.html"
-
-with open(output_filename, "w") as g:
-
-    print(HEADER, file=g)
-
-    print("<h1>New Lemma Exposures Alphabetically</h1>", file=g)
-    for lemma in sorted(index_by_lemma, key=coll.sort_key):
-      print(f'<div>{lemma} <span class="ref">{index_by_lemma[lemma]}</span></div>', file=g)
-
-
-for chapter_num in range(1, 20):
-    input_filename = f"analysis/lgpsi.{chapter_num:03d}.json"
+        for lemma in lemma_list:
+            index_by_lemma[lemma] = ref
+
+    write_page("docs/lgpsi_ref_index.html", [
+        header(),
+        "<h1>New Lemma Exposures by Ref</h1>",
+        *(
+            f'<div><span class="ref">{ref}</span> {" ".join(lemma_list)}</div>'
+            for ref, lemma_list in index_by_ref.items()
+        ),
+    ])
+
+    write_page("docs/lgpsi_lemma_index.html", [
+        header(),
+        "<h1>New Lemma Exposures Alphabetically</h1>",
+        *(
+            f'<div>{lemma} <span class="ref">{index_by_lemma[lemma]}</span></div>'
+            for lemma in sorted(index_by_lemma, key=collation_key)
+        ),
+    ])
+
+    render_search(concordance, index_by_ref, index_by_lemma)
+
+
+def search_key(s):
+    """
+    what a lemma or form is looked up by in the search index: lowercase with
+    no diacritics (and no final sigma), as the search page reduces queries.
+    """
+    return (
+        "".join(ch for ch in normalize("NFD", s) if not combining(ch))
+        .lower()
+        .replace("ς", "σ")
+    )
+
+
+def shard_prefixes(keys, depth=0):
+    """
+    returns {prefix: keys} sharding the given (sorted, distinct) keys by
+    prefix, splitting any shard of more than `SHARD_KEYS` keys by the next
+    letter. Keys no longer than a split prefix stay in that prefix's shard.
+    """
+    prefix = keys[0][:depth] if keys else ""
+    if len(keys) <= SHARD_KEYS:
+        return {prefix: keys}
+    shards = {}
+    short = [key for key in keys if len(key) <= depth]
+    if short:
+        shards[prefix] = short
+    groups = defaultdict(list)
+    for key in keys:
+        if len(key) > depth:
+            groups[key[:depth + 1]].append(key)
+    for group in groups.values():
+        shards.update(shard_prefixes(group, depth + 1))
+    return shards
+
+
+def shard_filename(prefix):
+    return "-".join(f"{ord(ch):x}" for ch in prefix) or "all"
+
+
+def write_search_file(filename, data):
+    """
+    writes a search file unless it is unchanged, so its compressed siblings
+    don't need writing again.
+    """
+    filename = os.path.join(SEARCH_DIRECTORY, filename)
+    content = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == content:
+                return
+    with open(filename, "w") as g:
+        g.write(content)
+
+
+def render_search(concordance, index_by_ref, index_by_lemma):
+    """
+    writes the search index into `docs/search` (and the page that uses it):
+    the lemmas and forms of the given `concordance.Concordance`, sharded by
+    the prefix of their search key so a lookup fetches one small shard, and
+    the new lemmas by ref, sharded by chapter.
+    """
+    os.makedirs(SEARCH_DIRECTORY, exist_ok=True)
+    refs = [
+        concordance.sentence(sentence_num)[0]
+        for sentence_num in range(concordance.sentence_count)
+    ]
+
+    lemmas = defaultdict(dict)
+    forms = defaultdict(dict)
+    for lemma in concordance.lemmas():
+        lemma_forms = {}
+        for form in concordance.forms(lemma):
+            form_refs = list(
+                dict.fromkeys(
+                    refs[sentence_num]
+                    for sentence_num, _ in concordance.lemma_postings(lemma, form)
+                )
+            )
+            lemma_forms[form] = len(form_refs)
+            forms[search_key(form)].setdefault(form, {})[lemma] = form_refs
+        lemmas[search_key(lemma)][lemma] = {
+            "first": index_by_lemma[lemma],
+            "forms": lemma_forms,
+        }
+
+    shards = shard_prefixes(sorted(lemmas.keys() | forms.keys()))
+    written = set()
+    for prefix, keys in shards.items():
+        filename = shard_filename(prefix) + ".json"
+        write_search_file(
+            filename,
+            {
+                "lemmas": {
+                    lemma: data
+                    for key in keys
+                    for lemma, data in lemmas.get(key, {}).items()
+                },
+                "forms": {
+                    form: data
+                    for key in keys
+                    for form, data in forms.get(key, {}).items()
+                },
+            },
+        )
+        written.add(filename)
+
+    by_chapter = defaultdict(dict)
+    for ref, lemma_list in index_by_ref.items():
+        by_chapter[ref.split(".")[0]][ref] = lemma_list
+    for chapter, chapter_refs in by_chapter.items():
+        filename = f"ref-{chapter}.json"
+        write_search_file(filename, chapter_refs)
+        written.add(filename)
+
+    # compressed siblings are left to `compress_docs`, which removes stale ones
+    for filename in os.listdir(SEARCH_DIRECTORY):
+        if filename not in written and not filename.endswith(
+            tuple(f".{extension}" for extension in COMPRESSION_EXTENSIONS)
+        ):  # from before the shards last changed
+            os.remove(os.path.join(SEARCH_DIRECTORY, filename))
+
+    manifest = json.dumps(
+        {prefix: shard_filename(prefix) for prefix in shards},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    write_page(
+        "docs/lgpsi_search.html",
+        [
+            header(),
+            "<h1>Search</h1>",
+            '<p><input id="query" size="30" autofocus'
+            ' placeholder="lemma, form or ref (e.g. λογος or 007.1.01)"></p>',
+            '<div id="results"></div>',
+            f"<script>\nconst SHARDS = {manifest};\n{SEARCH_SCRIPT}</script>",
+        ],
+    )
+
+
+def render_report(chapter_num, data, report_format="full"):
+    """
+    renders the report for a chapter from its `chapter_data.FullView`.
+
+    The `full` format has an entry for every lemma seen so far; the `chapter`
+    format only those in the chapter (so its size goes with the chapter's
+    own vocabulary), pointing to the alphabetical index for the rest.
+    """
     output_filename = f"docs/lgpsi_{chapter_num:03d}_report.html"
+    write_page(output_filename, report_lines(chapter_num, data, report_format))
 
-    data = json.load(open(input_filename))
-    with open(output_filename, "w") as g:
 
-      print(HEADER, file=g)
+def report_lines(chapter_num, data, report_format="full"):
 
-      print(f"<h1>Chapter {chapter_num} Report</h1>", file=g)
+    yield header()
 
-      print(f"""
+    yield f"<h1>Chapter {chapter_num} Report</h1>"
+
+    yield f"""
         <table>
           <tr>
             <th>&nbsp;</th>
@@ -190,38 +546,258 @@ for chapter_num in range(1, 20):
             <td>{data['new_form_tokens']} / {data['form_tokens']}</td>
           </tr>
         </table>
-      """, file=g)
-
-      for lemma, lemma_data in data["lemmas"].items():
-
-          print(f'<div class="lemma-entry">', file=g)
-          print(f'<h2>{lemma}</h2>', file=g)
-          print('<table class="lemma-data"><tr>', file=g)
-          if lemma_data["cumulative_last_seen"]:
-              print(f'<td>Last seen chapter: {lemma_data["cumulative_last_seen"]}</td>', file=g)
-              print(f'<td>Count before now: {lemma_data["cumulative_lemma_count"]}</td>', file=g)
-          else:
-              print(f'<td colspan="2">New in this chapter.</td>', file=g)
-          if lemma_data["chapter_lemma_count"]:
-              print(f'<td>Appears {lemma_data["chapter_lemma_count"]} time{"s" if lemma_data["chapter_lemma_count"] > 1 else ""} in this chapter.</td>', file=g)
-          else:
-              print(f'<td>Not in chapter {chapter_num}.</td>', file=g)
-          print('</tr></table>', file=g)
-
-          print('<table class="forms">', file=g)
-          for form, form_data in lemma_data["forms"].items():
-              print('<tr>', file=g)
-              print(f'<th>{form}</th>', file=g)
-              if form_data["cumulative_lemma_form_last_seen"]:
-                  print(f'<td>Last seen chapter: {form_data["cumulative_lemma_form_last_seen"]}</td>', file=g)
-                  print(f'<td>Count before now: {form_data["cumulative_lemma_form_count"]}</td>', file=g)
-              else:
-                  print(f'<td colspan="2">New in this chapter.</td>', file=g)
-              if form_data["chapter_lemma_form_count"]:
-                  print(f'<td>Appears {form_data["chapter_lemma_form_count"]} time{"s" if form_data["chapter_lemma_form_count"] > 1 else ""} in this chapter.</td>', file=g)
-              else:
-                  print(f'<td>Not in chapter {chapter_num}.</td>', file=g)
-              print('</tr>', file=g)
-          print('</table>', file=g)
-
-          print('</div>', file=g)
+      """
+
+    chapter_only = report_format == "chapter"
+    if chapter_only:
+        yield (
+            f"<p>{data.unseen_count()} lemmas seen before are not in chapter"
+            f" {chapter_num}"
+            ' (see the <a href="lgpsi_lemma_index.html">alphabetical index</a>).</p>'
+        )
+
+    for lemma, lemma_data in data.lemmas(chapter_only):
+
+        yield f'<div class="lemma-entry">'
+        yield f'<h2>{lemma}</h2>'
+        yield '<table class="lemma-data"><tr>'
+        if lemma_data["cumulative_last_seen"]:
+            yield f'<td>Last seen chapter: {lemma_data["cumulative_last_seen"]}</td>'
+            yield f'<td>Count before now: {lemma_data["cumulative_lemma_count"]}</td>'
+        else:
+            yield f'<td colspan="2">New in this chapter.</td>'
+        count = lemma_data["chapter_lemma_count"]
+        if count:
+            plural = "s" if count > 1 else ""
+            yield f"<td>Appears {count} time{plural} in this chapter.</td>"
+        else:
+            yield f'<td>Not in chapter {chapter_num}.</td>'
+        yield '</tr></table>'
+
+        yield '<table class="forms">'
+        for form, form_data in lemma_data["forms"].items():
+            yield '<tr>'
+            yield f'<th>{form}</th>'
+            last_seen = form_data["cumulative_lemma_form_last_seen"]
+            if last_seen:
+                yield f"<td>Last seen chapter: {last_seen}</td>"
+                form_count = form_data["cumulative_lemma_form_count"]
+                yield f"<td>Count before now: {form_count}</td>"
+            else:
+                yield f'<td colspan="2">New in this chapter.</td>'
+            count = form_data["chapter_lemma_form_count"]
+            if count:
+                plural = "s" if count > 1 else ""
+                yield f"<td>Appears {count} time{plural} in this chapter.</td>"
+            else:
+                yield f'<td>Not in chapter {chapter_num}.</td>'
+            yield '</tr>'
+        yield '</table>'
+
+        yield '</div>'
+
+
+def process_report(chapter_num, cumulative, write=True, report_format="full"):
+    """
+    renders the report for a chapter (unless `write` is false, as when just
+    catching up) and adds the chapter's delta to `cumulative`.
+    """
+    output_filename = f"docs/lgpsi_{chapter_num:03d}_report.html"
+    with PROFILE.chapter(
+        "report",
+        chapter_num,
+        [delta_filename(chapter_num)],
+        [output_filename] if write else [],
+    ) as record:
+        delta = read_delta(chapter_num)
+        if write:
+            render_report(
+                chapter_num, FullView(chapter_num, delta, cumulative), report_format
+            )
+        record["tokens"] += delta["lemma_tokens"]
+        cumulative.add(chapter_num, delta)
+
+
+class RenderState:
+    """
+    the key (a fingerprint of its inputs and the rendering code) and content
+    hash of each page as last rendered, so unchanged pages can be skipped.
+    """
+
+    def __init__(self, force=False):
+        self.force = force
+        self.pages = {}
+        if os.path.exists(STATE_FILENAME):
+            with open(STATE_FILENAME) as f:
+                self.pages = json.load(f)
+        # (every page's navigation lists the chapters)
+        self.code_hash = fingerprint(
+            format_chapters(CHAPTERS),
+            SHARED_ASSETS,
+            *(file_hash(filename) for filename in CODE_FILENAMES),
+        )
+        self.rendered = 0
+        self.skipped = 0
+
+    def key(self, *inputs):
+        return fingerprint(self.code_hash, *inputs)
+
+    def is_fresh(self, filenames, key):
+        fresh = not self.force and all(
+            filename in self.pages
+            and self.pages[filename]["key"] == key
+            and self.pages[filename]["output"] == file_hash(filename)
+            for filename in filenames
+        )
+        if fresh:
+            self.skipped += len(filenames)
+        return fresh
+
+    def rendered_pages(self, filenames, key):
+        self.rendered += len(filenames)
+        for filename in filenames:
+            self.pages[filename] = {"key": key, "output": file_hash(filename)}
+
+    def save(self):
+        with open(STATE_FILENAME + ".tmp", "w") as g:
+            json.dump(self.pages, g)
+        os.replace(STATE_FILENAME + ".tmp", STATE_FILENAME)
+
+
+def compress_file(filename):
+    """
+    writes the `COMPRESSION` siblings of a file, returning its size and theirs.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    sizes = [len(data)]
+    for extension in COMPRESSION:
+        if extension == "gz":
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        else:
+            compressed = brotli.compress(data, quality=11)
+        with open(f"{filename}.{extension}", "wb") as g:
+            g.write(compressed)
+        sizes.append(len(compressed))
+    return sizes
+
+
+def compress_docs():
+    """
+    writes the `COMPRESSION` siblings (in parallel) of every page and asset in
+    `docs` that lacks them or has changed since, printing the sizes, and
+    removes any other siblings (from a run with other settings, or of files
+    since removed) so none is left stale.
+    """
+    if "br" in COMPRESSION and brotli is None:
+        raise SystemExit("writing .br files needs the brotli package")
+    filenames = []
+    stale = []
+    for directory, _, names in os.walk("docs"):
+        for name in sorted(names):
+            filename = os.path.join(directory, name)
+            source, extension = os.path.splitext(filename)
+            if extension[1:] in COMPRESSION_EXTENSIONS:
+                if extension[1:] not in COMPRESSION or not os.path.exists(source):
+                    stale.append(filename)
+            elif filename.endswith(COMPRESSED_EXTENSIONS) and any(
+                not os.path.exists(f"{filename}.{extension}")
+                or os.path.getmtime(f"{filename}.{extension}")
+                < os.path.getmtime(filename)
+                for extension in COMPRESSION
+            ):
+                filenames.append(filename)
+
+    for filename in stale:
+        os.remove(filename)
+    if stale:
+        print(f"removed {len(stale)} stale compressed files.")
+    if not COMPRESSION:
+        return
+
+    with ThreadPoolExecutor() as executor:
+        all_sizes = list(executor.map(compress_file, filenames))
+
+    totals = [0] * (len(COMPRESSION) + 1)
+    for filename, sizes in zip(filenames, all_sizes):
+        print(f"{filename:40}" + "".join(f" {size:>9}" for size in sizes))
+        totals = [total + size for total, size in zip(totals, sizes)]
+    print(
+        f"compressed {len(filenames)} files: {totals[0]} bytes"
+        + "".join(
+            f", {total} as .{extension}"
+            for extension, total in zip(COMPRESSION, totals[1:])
+        )
+    )
+
+
+def render_all(force=False, report_format="full", only=None):
+    """
+    renders every page (or, for chapters, just those in `only`) whose inputs
+    have changed since it was last rendered.
+    """
+    state = RenderState(force)
+
+    for chapter_num in selected(CHAPTERS, only):
+        page = f"docs/lgpsi_{chapter_num:03d}.html"
+        key = state.key(file_hash(analysis_filename(chapter_num, "exposures")))
+        if not state.is_fresh([page], key):
+            render_chapter(chapter_num)
+            state.rendered_pages([page], key)
+
+    if concordance_is_stale(CHAPTERS):
+        print(f"building {CONCORDANCE_FILENAME}.")
+        build_concordance(CHAPTERS)
+    key = state.key(file_hash(CONCORDANCE_FILENAME))
+    if not state.is_fresh(INDEX_FILENAMES, key):
+        with Concordance() as concordance:
+            render_indexes(concordance)
+        state.rendered_pages(INDEX_FILENAMES, key)
+
+    # each report depends on its own and every earlier chapter's delta
+    cumulative = Cumulative()
+    delta_hashes = [report_format]
+    for chapter_num, write in catching_up(CHAPTERS, only):
+        page = f"docs/lgpsi_{chapter_num:03d}_report.html"
+        delta_hashes.append(file_hash(delta_filename(chapter_num)))
+        key = state.key(*delta_hashes)
+        fresh = not write or state.is_fresh([page], key)
+        process_report(
+            chapter_num, cumulative, write=not fresh, report_format=report_format
+        )
+        if not fresh:
+            state.rendered_pages([page], key)
+
+    state.save()
+    print(f"rendered {state.rendered} pages, {state.skipped} unchanged.")
+
+    compress_docs()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--force", action="store_true", help="render every page, changed or not"
+    )
+    parser.add_argument(
+        "--report-format", choices=["full", "chapter"], default="full",
+        help="report every lemma seen so far (full) or just the chapter's (chapter)",
+    )
+    parser.add_argument(
+        "--shared-assets", action="store_true",
+        help=f"link pages to shared CSS and navigation files (as {ASSETS_ENV}=shared)",
+    )
+    parser.add_argument(
+        "--compress", action="append", choices=["gz", "br"],
+        help=f"also write .gz (or .br) files of each page (as {COMPRESS_ENV}=gz,br)",
+    )
+    chapters_argument(parser)
+    profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile(args)
+    if args.shared_assets:
+        SHARED_ASSETS = True
+    if args.compress:
+        COMPRESSION = args.compress
+
+    render_all(force=args.force, report_format=args.report_format, only=args.chapters)
@@ -4,8 +4,7 @@ import sys
 
 import yaml
 
-from pyuca import Collator
-c = Collator()
+from collation import collation_key
 
 FILENAME = sys.argv[1]
 
@@ -14,7 +13,7 @@ with open(FILENAME) as f:
     data = yaml.safe_load(f)
 
     # sort based on the keys using pyuca
-    data = dict(sorted(data.items(), key=lambda x: c.sort_key(x[0])))
+    data = dict(sorted(data.items(), key=lambda x: collation_key(x[0])))
 
 
 with open(FILENAME, "w") as g:
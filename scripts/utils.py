@@ -1,9 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import hashlib
+import importlib.util
+import os.path
+import sys
 from unicodedata import normalize, category
 
+from profiling import PROFILE
+
+# the combining marks in the Basic Multilingual Plane (anything beyond it is
+# looked up as it comes)
+COMBINING_MARKS = frozenset(
+    chr(code_point)
+    for code_point in range(0x10000)
+    if category(chr(code_point))[0] == "M"
+)
+
+
+@lru_cache(maxsize=65536)
 def real_len(s):
+    """
+    the display width of a token: its length without combining marks (once
+    decomposed). Cached as the same few thousand tokens recur throughout.
+    """
     l = 0
     for ch in normalize("NFD", s):
-        if category(ch)[0] != "M":
+        if ch not in COMBINING_MARKS and (ch < "\U00010000" or category(ch)[0] != "M"):
             l += 1
     return l
 
@@ -12,13 +34,97 @@ def real_just(t, l):
     return t + (" " * (l - real_len(t)))
 
 
+def column_widths(token_lists):
+    """
+    returns the widths of the tokens in each of the given rows and the width
+    of each column, in one pass over the tokens.
+    """
+    lengths = [[real_len(t) for t in token_list] for token_list in token_lists]
+    return lengths, [max(column) for column in zip(*lengths)]
+
+
 def print_interlinear(token_lists, fout):
-    max_len = [max(map(real_len, x)) for x in zip(*token_lists)]
-    print(file=fout)
-    for token_list in token_lists:
-        print(
-            " ".join(
-                real_just(t, l) for l, t in zip(max_len, token_list)
-            ).strip(),
-            file=fout
-        )
+    lengths, max_len = column_widths(token_lists)
+    lines = [
+        " ".join(
+            t + " " * (l - n) for l, t, n in zip(max_len, token_list, token_lengths)
+        ).strip()
+        for token_list, token_lengths in zip(token_lists, lengths)
+    ]
+    fout.write("\n" + "\n".join(lines) + "\n")  # the block in a single write
+
+
+def load_script(name):
+    """
+    imports one of the scripts by name (most of their filenames aren't valid
+    module names so can't just be imported).
+
+    If the script is the one being run, that is returned rather than loading
+    a second copy.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{name}.py")
+    main = sys.modules.get("__main__")
+    if os.path.abspath(getattr(main, "__file__", "")) == path:
+        return main
+    module_name = name.replace("-", "_")
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
+
+
+def call_script(name, function, *args):
+    return getattr(load_script(name), function)(*args)
+
+
+def call_script_in_worker(name, function, *args):
+    """
+    calls a script's function in a worker process, also returning what was
+    profiled for the parent to merge.
+    """
+    PROFILE.reset()
+    return call_script(name, function, *args), PROFILE.take()
+
+
+def map_chapters(name, function, chapters, jobs=1):
+    """
+    calls `function(chapter_num)` from the named script for each chapter,
+    fanned out over `jobs` processes if more than one, and returns the results
+    in chapter order.
+
+    (The function is passed by script and name rather than as an object so
+    worker processes can load it whichever way they are started.)
+    """
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            outcomes = list(
+                executor.map(partial(call_script_in_worker, name, function), chapters)
+            )
+        for _, recorded in outcomes:
+            PROFILE.merge(recorded)
+        return [result for result, _ in outcomes]
+    return [call_script(name, function, chapter_num) for chapter_num in chapters]
+
+
+def file_hash(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def fingerprint(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def jobs_argument(parser):
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1, metavar="N",
+        help="number of chapters to process in parallel",
+    )
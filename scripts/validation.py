@@ -0,0 +1,115 @@
+"""
+the checks `validate-text` makes of the files in `text` (configured in
+`config/text-validator-para.toml` and `config/text-validator-sent.toml`),
+compiled so the scripts can check each line as they write it and stop at the
+first bad one rather than it only being found in CI.
+
+The token regexes are combined into one and tokens already found good aren't
+checked again, so checking costs little next to writing the line.
+"""
+
+from functools import lru_cache
+import re
+import unicodedata
+
+try:
+    import tomllib as toml
+except ImportError:  # before Python 3.11 (`toml` comes with text-validator)
+    import toml
+
+
+CONFIG_FILENAME = "config/text-validator-{}.toml"
+
+PLUGIN = "text_validator.plugins.{}"
+
+
+class ValidationError(Exception):
+    pass
+
+
+class Validator:
+    """
+    the whitespace, Unicode, ref and character checks of a text-validator
+    config.
+    """
+
+    def __init__(self, config):
+        whitespace = config.get(PLUGIN.format("whitespace"), {})
+        self.check_crlf = whitespace.get("CHECK_CRLF", False)
+        self.check_tabs = whitespace.get("CHECK_TABS", False)
+        self.check_trailing_whitespace = whitespace.get(
+            "CHECK_TRAILING_WHITESPACE", False
+        )
+        self.check_nfc = config.get(PLUGIN.format("unicode"), {}).get(
+            "CONFIRM_UTF_8_NFC", False
+        )
+
+        ref_regex = config.get(PLUGIN.format("ref_line_format"), {}).get("REF_REGEX")
+        self.ref_regex = re.compile(ref_regex) if ref_regex else None
+
+        characters = config.get(PLUGIN.format("characters"), {})
+        self.replacements = dict(characters.get("REPLACE_CHARS", []))
+        self.bad_chars = (
+            re.compile("[" + "".join(map(re.escape, self.replacements)) + "]")
+            if self.replacements else None
+        )
+        token_regexes = characters.get("TOKEN_REGEXES")
+        self.token_regex = (
+            re.compile("|".join(f"(?:{regex})" for regex in token_regexes))
+            if token_regexes
+            else None
+        )
+        self.good_tokens = set()
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            return cls(toml.loads(f.read().decode("utf-8")))
+
+    def problem(self, line):
+        """
+        returns what is wrong with a line (without its newline), if anything.
+        """
+        if self.check_crlf and "\r" in line:
+            return "carriage return"
+        if self.check_tabs and "\t" in line:
+            return "tab"
+        if self.check_trailing_whitespace and line != line.rstrip():
+            return "trailing whitespace"
+        if self.check_nfc and not unicodedata.is_normalized("NFC", line):
+            return "not NFC"
+        if self.bad_chars:
+            match = self.bad_chars.search(line)
+            if match:
+                bad = match.group()
+                good = self.replacements[bad]
+                return f"character U+{ord(bad):04X} should be U+{ord(good):04X}"
+
+        tokens = line.split()
+        if self.ref_regex and not (tokens and self.ref_regex.match(tokens[0])):
+            return "bad ref"
+        if self.token_regex:
+            for position, token in enumerate(tokens):
+                if token not in self.good_tokens:
+                    if not self.token_regex.match(token):
+                        return f"bad token {token!r} at position {position}"
+                    self.good_tokens.add(token)
+        return None
+
+    def check(self, line, filename, line_num):
+        """
+        raises a `ValidationError` (naming the file, line and ref) if a line
+        that is to be written at the given place fails the checks.
+        """
+        problem = self.problem(line)
+        if problem:
+            ref = line.split(maxsplit=1)[0] if line.strip() else ""
+            raise ValidationError(f"{filename}:{line_num}: {ref}: {problem}")
+
+
+@lru_cache(maxsize=None)
+def validator(name):
+    """
+    the validator for the named config (`para` or `sent`).
+    """
+    return Validator.load(CONFIG_FILENAME.format(name))
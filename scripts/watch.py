@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+rebuilds what is out of date whenever `orig`, `manual-data` or `config` changes.
+
+Runs the same incremental build as `pipeline.py` but stays resident, so the
+caches are loaded once. A change to the scripts or to which chapters there are
+restarts the process.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+
+from chapters import MANIFEST_FILENAME, corpus_chapters
+from collation import COLLATION
+from normalisation import NORMALISATION
+from pipeline import STAGES, build
+from utils import load_script
+from validation import ValidationError, validator
+
+
+# directories watched and the files in them that are sources
+WATCHED = {
+    "orig": ["*.md"],
+    "manual-data": ["*.yaml"],
+    "config": ["*.toml", "*.yaml"],
+    "scripts": ["*.py"],
+}
+
+OVERRIDES_FILENAME = "manual-data/lemma_overrides.yaml"
+
+# how long to wait for a burst of changes (e.g. an editor's save) to finish
+SETTLE_SECONDS = 0.1
+
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+
+def is_source(path):
+    directory, name = os.path.split(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in WATCHED.get(directory, []))
+
+
+class InotifyWatcher:
+    """
+    waits for changes to the watched directories with Linux's inotify.
+    """
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, directory.encode(), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"can't watch {directory}")
+            self.directories[wd] = directory
+
+    def read_changes(self):
+        changed = set()
+        data = os.read(self.fd, 1 << 16)
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0").decode()
+            offset += length
+            changed.add(os.path.join(self.directories[wd], name))
+        return changed
+
+    def wait(self):
+        """
+        blocks until something changes, returning the paths changed.
+        """
+        select.select([self.fd], [], [])
+        changed = self.read_changes()
+        while select.select([self.fd], [], [], SETTLE_SECONDS)[0]:
+            changed |= self.read_changes()
+        return changed
+
+
+class PollingWatcher:
+    """
+    waits for changes to the watched directories by checking the files'
+    modification times and sizes every `interval` seconds.
+    """
+
+    def __init__(self, directories, interval=0.5):
+        self.directories = directories
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for directory in self.directories:
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+            snapshot = self.scan()
+            changed = {
+                path for path in self.snapshot.keys() | snapshot.keys()
+                if self.snapshot.get(path) != snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+
+def open_watcher(directories, poll=False, interval=0.5):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:  # AttributeError if libc lacks inotify
+            print(f"inotify unavailable ({e}), polling instead.")
+    return PollingWatcher(directories, interval)
+
+
+class Watch:
+    """
+    the resident state: the lemmatisation stage's Morpheus is kept open and
+    the caches loaded, the overrides reloaded when they change.
+    """
+
+    def __init__(self):
+        self.lemma_stage = next(stage for stage in STAGES if stage.name == "lemma")
+        self.morpheus = None
+
+    def warm(self):
+        for stage in STAGES:
+            stage.module  # loads the script
+        COLLATION.load()
+        COLLATION.load_collator()
+        NORMALISATION.load()
+        validator("para")
+        validator("sent")
+        self.open_morpheus()
+
+    def open_morpheus(self):
+        self.close_morpheus()
+        self.morpheus = load_script("lemmatise").open_morpheus()
+        self.morpheus.__enter__()
+        self.lemma_stage.morpheus = self.morpheus
+
+    def close_morpheus(self):
+        if self.morpheus is not None:
+            self.morpheus.__exit__(None, None, None)
+            self.morpheus = self.lemma_stage.morpheus = None
+
+    def reload_overrides(self):
+        lemmatise = load_script("lemmatise")
+        lemmatise.lemma_overrides = lemmatise.LemmaOverrides.load()
+        self.open_morpheus()  # an offline backend is seeded from the overrides
+
+    def rebuild(self):
+        start = time.perf_counter()
+        try:
+            build()
+        except ValidationError as e:
+            print(f"invalid text: {e}")
+            return
+        except Exception:
+            traceback.print_exc()
+            print("build failed; waiting for the next change.")
+            return
+        finally:
+            COLLATION.save()
+            NORMALISATION.save()
+        print(f"rebuilt in {time.perf_counter() - start:.2f}s.")
+
+
+def restart(reason):
+    print(f"{reason}; restarting.")
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable, *sys.argv])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--poll", action="store_true", help="poll for changes rather than using inotify"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.5, help="seconds between polls"
+    )
+    args = parser.parse_args()
+
+    CHAPTERS = corpus_chapters()
+    watcher = open_watcher(list(WATCHED), args.poll, args.interval)
+    watch = Watch()
+    start = time.perf_counter()
+    watch.warm()
+    print(f"loaded in {time.perf_counter() - start:.2f}s.")
+    watch.rebuild()
+
+    try:
+        while True:
+            print(f"watching {', '.join(WATCHED)} for changes.")
+            changed = sorted(filter(is_source, watcher.wait()))
+            if not changed:
+                continue
+            print(f"changed: {', '.join(changed)}")
+            if any(path.startswith("scripts/") for path in changed):
+                watch.close_morpheus()
+                restart("scripts changed")
+            if MANIFEST_FILENAME in changed or corpus_chapters() != CHAPTERS:
+                watch.close_morpheus()
+                restart("chapters changed")
+            if OVERRIDES_FILENAME in changed:
+                watch.reload_overrides()
+            if any(path.startswith("config/") for path in changed):
+                validator.cache_clear()
+            watch.rebuild()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watch.close_morpheus()